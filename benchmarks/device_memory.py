@@ -0,0 +1,61 @@
+''' Measures the memory used by the engine's device objects. Run with
+
+    python -m benchmarks.device_memory [device count ...]
+
+    Each count of devices is spread over clients of 100 devices with a
+    mix of inputs, outputs and input/outputs, and includes the engine's
+    device dict, the clients' device dicts and their ingest plans. '''
+
+import sys
+import tracemalloc
+
+from switchboard.device import RESTDevice
+from switchboard.engine import _ClientInfo
+
+
+DEVICES_PER_CLIENT = 100
+DEFAULT_COUNTS = [ 10000, 100000 ]
+
+
+def _create_devices(count):
+    devices = {}
+    clients = []
+    for client_index in range(count // DEVICES_PER_CLIENT):
+        alias = 'client{}'.format(client_index)
+        client_devices = {}
+        for device_index in range(DEVICES_PER_CLIENT):
+            suffix = ('i', 'o', 'io')[device_index % 3]
+            name = '{}.device{}.{}'.format(alias, device_index, suffix)
+            device = RESTDevice({ 'name': name, 'readable': 'i' in suffix, 'writeable': 'o' in suffix },
+                                'http://' + alias, None)
+            device.update_value(device_index)
+            client_devices[device.name] = device
+
+        # The client's HTTP session isn't part of the device layer
+        client = _ClientInfo('http://' + alias, alias, client_devices, None, session=object())
+        client.compile_ingest_plan()
+        devices.update(client_devices)
+        clients.append(client)
+    return devices, clients
+
+
+def measure(count):
+    ''' Returns the number of bytes allocated for count devices '''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    devices, clients = _create_devices(count)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used
+
+
+def main():
+    counts = [ int(c) for c in sys.argv[1:] ] or DEFAULT_COUNTS
+    print('{:>10} {:>12} {:>14}'.format('devices', 'total MB', 'bytes/device'))
+    for count in counts:
+        used = measure(count)
+        print('{:>10} {:>12.1f} {:>14.0f}'.format(count, used / 1e6, used / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ from switchboard.ws_ctrl_client import WSCtrlHandlerBase
 from switchboard.utils import colour_text, get_input, is_float
 
 from switchboard.config import CONFIG_OPTS
+from switchboard.stats import STATS_TARGETS
 from apps.app_list import APP_LIST
 
 
@@ -369,6 +370,23 @@ class SwitchboardWSCli(cmd.Cmd, WSCtrlHandlerBase):
         return AutoComplete(text, line, options)
 
 
+    def help_stats(self):
+        print('Usage:')
+        print('stats engine         show tick phase timings and client poll latencies')
+        print('stats graph          show the module evaluation order, critical path and cycles')
+        print('stats lock           show engine lock wait and hold times')
+        print('stats modules        show module call counts and runtimes')
+        print('stats outputs        show output write queue depth and latency')
+        print('stats tick           show tick jitter and overrun counts')
+
+    @check_argument_count(1)
+    def do_stats(self, args):
+        self.ws_client.send('stats', args)
+
+    def complete_stats(self, text, line, begidx, endidx):
+        return AutoComplete(text, line, STATS_TARGETS)
+
+
     def help_get(self):
         print('Usage:')
         print('get [device]         show value of device')
@@ -9,6 +9,7 @@ import sys
 from switchboard.config import SwitchboardConfig
 from switchboard.ws_ctrl_server import WSCtrlServer
 from switchboard.engine import SwitchboardEngine
+from switchboard.value_store import ValueStore
 from switchboard.app_manager import AppManager
 from switchboard.cli import SwitchboardCli
 from switchboard.log import init_logging
@@ -18,6 +19,8 @@ def main():
     try:
         arg_parser = argparse.ArgumentParser()
         arg_parser.add_argument('-c', '--config', help='specify .json config file')
+        arg_parser.add_argument('-s', '--value-store', help='where the device values are kept, '
+                '\'columnar\' requires NumPy', choices=['objects', 'columnar'], default='objects')
         args = arg_parser.parse_args()
 
         swb_config = SwitchboardConfig()
@@ -26,8 +29,10 @@ def main():
 
         init_logging(swb_config)
 
+        value_store = ValueStore() if args.value_store == 'columnar' else None
+
         ws_ctrl_server = WSCtrlServer(swb_config)
-        swb = SwitchboardEngine(swb_config, ws_ctrl_server)
+        swb = SwitchboardEngine(swb_config, ws_ctrl_server, value_store)
 
         with AppManager(swb_config, swb) as app_manager:
             cli = SwitchboardCli(swb, swb_config, app_manager)
@@ -0,0 +1,68 @@
+
+import time
+
+
+class CircuitBreaker(object):
+    ''' Keeps a client that keeps failing from being polled at every
+        tick. Once the client has failed failure_threshold times in a row
+        the breaker opens and the client is only probed every now and
+        then. The time between probes starts at base_backoff seconds and
+        doubles with every failed probe up to max_backoff seconds. The
+        first successful request closes the breaker again. '''
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+
+    def __init__(self, base_backoff=1.0, clock=time.monotonic):
+        self._clock = clock
+        self.base_backoff = base_backoff
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = 0.0
+
+        # Monotonic time at which the next probe is allowed
+        self.next_probe = None
+
+    def is_open(self):
+        return self.state == self.OPEN
+
+    def allow_request(self, now=None):
+        ''' Returns True if the client may be polled '''
+        if self.state == self.CLOSED:
+            return True
+
+        if now is None:
+            now = self._clock()
+        return now >= self.next_probe
+
+    def record_success(self):
+        ''' Closes the breaker. Returns True if it was open. '''
+        was_open = self.state == self.OPEN
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = 0.0
+        self.next_probe = None
+        return was_open
+
+    def record_failure(self, failure_threshold, max_backoff, now=None):
+        ''' Records a failed request. Returns True if the breaker opened
+            because of this failure. '''
+        if now is None:
+            now = self._clock()
+
+        self.failures += 1
+
+        if self.state == self.OPEN:
+            # A failed probe
+            self.backoff = min(self.backoff * 2, max_backoff)
+            self.next_probe = now + self.backoff
+            return False
+
+        if self.failures >= failure_threshold:
+            self.state = self.OPEN
+            self.backoff = min(self.base_backoff, max_backoff)
+            self.next_probe = now + self.backoff
+            return True
+
+        return False
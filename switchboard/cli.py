@@ -6,6 +6,7 @@ import logging
 
 from switchboard.config import CONFIG_OPTS
 from switchboard.engine import EngineError
+from switchboard.stats import STATS_TARGETS, format_stats
 from switchboard.utils import colour_text, get_input, is_float
 
 from apps.app_list import APP_LIST
@@ -363,6 +364,29 @@ class SwitchboardCli(cmd.Cmd, object):
         return AutoComplete(text, line, options)
 
 
+    def help_stats(self):
+        print('Usage:')
+        print('stats engine         show tick phase timings and client poll latencies')
+        print('stats graph          show the module evaluation order, critical path and cycles')
+        print('stats lock           show engine lock wait and hold times')
+        print('stats modules        show module call counts and runtimes')
+        print('stats outputs        show output write queue depth and latency')
+        print('stats tick           show tick jitter and overrun counts')
+
+    def do_stats(self, line):
+        # Not synchronised with the engine so that stats can be queried
+        # while the engine is busy
+        text = format_stats(self._swb, line.strip().lower())
+        if text is None:
+            print('Unkown stats command "{}"'.format(line))
+            self.help_stats()
+        else:
+            print(text)
+
+    def complete_stats(self, text, line, begidx, endidx):
+        return AutoComplete(text, line, STATS_TARGETS)
+
+
     def help_get(self):
         print('Usage:')
         print('get [device]         show value of device')
@@ -1,10 +1,18 @@
 
 import json
+import time
+import uuid
+import logging
+import requests
 from functools import wraps
+from threading import Lock, RLock, Thread
 
 from bottle import Bottle, request, response
 
 
+logger = logging.getLogger(__name__)
+
+
 class _SwitchboardDevice(object):
     def __init__(self, name, read_callback, write_callback, readable, writeable, classname):
         if name.split('.')[-1] != self.SUFFIX:
@@ -62,6 +70,16 @@ class SwitchboardDeviceStore(object):
         super(SwitchboardDeviceStore, self).__init__(**kwargs)
         self._devices = {}
 
+        # Change tracking: the sequence number is bumped every time the
+        # reported value or error of a device changes. The epoch
+        # identifies this instance of the store so that sequence numbers
+        # from before a restart are never mistaken for current ones.
+        self._seq = 0
+        self._epoch = uuid.uuid4().hex
+        self._last_reported = {}
+        self._change_seq = {}
+        self._change_lock = RLock()
+
     def add_device(self, device):
         ''' Adds a device to the store '''
         if device.name in self._devices:
@@ -75,15 +93,35 @@ class SwitchboardDeviceStore(object):
             devices_info.append(device._get_info())
         return devices_info
 
-    def _get_devices_value(self):
-        ''' Gets an array with all the device values '''
+    def _get_devices_value(self, since=None):
+        ''' Gets an array with all the device values. If since is given
+            only the devices that changed after that sequence number are
+            returned. '''
         devices_value = []
-        for device in self._devices.values():
-            value = device._get_value()
-            if len(value) > 0:
-                devices_value.append(value)
+        with self._change_lock:
+            for device in self._devices.values():
+                value = device._get_value()
+                if len(value) == 0:
+                    continue
+
+                if self._last_reported.get(device.name) != value:
+                    self._seq += 1
+                    self._last_reported[device.name] = value
+                    self._change_seq[device.name] = self._seq
+
+                if since is None or self._change_seq[device.name] > since:
+                    devices_value.append(value)
         return devices_value
 
+    def _get_devices_value_response(self, since=None, epoch=None):
+        ''' Gets the response body for a devices value request. A delta
+            is only returned if the request refers to this store's epoch
+            and to a sequence number that has already been handed out. '''
+        with self._change_lock:
+            delta = since is not None and epoch == self._epoch and since <= self._seq
+            devices = self._get_devices_value(since if delta else None)
+            return { 'devices': devices, 'seq': self._seq, 'epoch': self._epoch, 'delta': delta }
+
     def set_device_value(self, name, value):
         if not name in self._devices:
             raise KeyError('Could not set value of device {} as it does not exist'.format(name))
@@ -93,26 +131,91 @@ class SwitchboardDeviceStore(object):
 
 
 class SwitchboardClient(SwitchboardDeviceStore):
-    def __init__(self, quiet=True, debug=False, **kwargs):
+    ''' Serves the devices to the Switchboard engine. By default the engine
+        polls the client. If push_url is set (e.g.
+        'http://192.168.1.1:5000/devices_push', the push_host and push_port
+        of the engine) the client also pushes its device value changes to the
+        engine every push_period seconds, or whenever push_changes() is
+        called, so that the engine can act on them without waiting for
+        the next poll. The client still has to be added to the engine,
+        which keeps polling it. '''
+
+    def __init__(self, quiet=True, debug=False, push_url=None, push_period=0.1, **kwargs):
         super(SwitchboardClient, self).__init__(**kwargs)
         self._quiet = quiet
         self._debug = debug
+        self._push_url = push_url
+        self._push_period = push_period
+
+        # Sequence number of the last changes the engine accepted
+        self._pushed_seq = 0
+        self._push_session = None
+        self._push_lock = Lock()
         self._app = Bottle()
         self._app.route('/devices_info', method='GET', callback=self._devices_info)
         self._app.route('/devices_value', method='GET', callback=self._devices_value)
         self._app.route('/device_set', method='PUT', callback=self._device_set)
+        self._app.route('/devices_set', method='PUT', callback=self._devices_set)
 
     def run_client(self, port, host='0.0.0.0'):
+        if self._push_url:
+            thread = Thread(target=self._push_loop)
+            thread.daemon = True
+            thread.start()
+
         self._app.run(host=host, port=port, debug=self._debug, quiet=self._quiet)
 
+    def push_changes(self):
+        ''' Push the device values that changed since the last successful
+            push to the engine. Event driven devices can call this as soon
+            as a value changes. Returns False if the engine didn't accept
+            the values, in which case they are sent again with the next
+            push. '''
+        with self._push_lock:
+            changes = self._get_devices_value_response(self._pushed_seq, self._epoch)
+            if not changes['devices']:
+                return True
+
+            if not self._push_session:
+                self._push_session = requests.Session()
+
+            try:
+                r = self._push_session.put(self._push_url, data=json.dumps(changes), timeout=1)
+                error = r.json().get('error')
+            except Exception as e:
+                error = str(e)
+
+            if error:
+                # The engine doesn't know the client until it has polled it
+                logger.debug('Unable to push values to {}: {}'.format(self._push_url, error))
+                return False
+
+            self._pushed_seq = changes['seq']
+            return True
+
+    def _push_loop(self):
+        while True:
+            time.sleep(self._push_period)
+            self.push_changes()
+
     def _devices_info(self):
         response.headers['Content-Type'] = 'application/json'
         devices_list = { 'devices': self._get_devices_info() }
         return json.dumps(devices_list)
 
     def _devices_value(self):
+        ''' Returns the device values. With the optional 'since' and
+            'epoch' query parameters only the devices that changed since
+            the given sequence number are returned. '''
         response.headers['Content-Type'] = 'application/json'
-        devices_list = { 'devices': self._get_devices_value() }
+
+        since = request.query.get('since')
+        try:
+            since = int(since) if since is not None else None
+        except ValueError:
+            since = None
+
+        devices_list = self._get_devices_value_response(since, request.query.get('epoch'))
         return json.dumps(devices_list)
 
     def _device_set(self):
@@ -145,3 +248,41 @@ class SwitchboardClient(SwitchboardDeviceStore):
                 retval['error'] = str(e)
 
         return json.dumps(retval)
+
+    def _devices_set(self):
+        ''' Sets the values of several devices with one request. The body
+            of the PUT request is of the form
+            { "devices": [ { "name": <name>, "value": <value> }, ... ] }.
+            Every device is set even if setting a previous one failed. '''
+        response.headers['Content-Type'] = 'application/json'
+        retval = { }
+
+        try:
+            data = json.loads(request.body.read().decode('ascii'))
+        except:
+            retval['error'] = 'Unable to decode json data from PUT request'
+            return json.dumps(retval)
+
+        if data is None or not 'devices' in data:
+            retval['error'] = 'No "devices" field in body of PUT request'
+            return json.dumps(retval)
+
+        errors = []
+        for device in data['devices']:
+            try:
+                if not 'name' in device:
+                    raise KeyError('No "name" field for device in body of PUT request')
+
+                if not 'value' in device:
+                    raise KeyError('No "value" field for device {} in body of PUT request'.format(device['name']))
+
+                self.set_device_value(device['name'], device['value'])
+            except Exception as e:
+                if self._debug:
+                    raise
+                errors.append(str(e))
+
+        if errors:
+            retval['error'] = '; '.join(errors)
+
+        return json.dumps(retval)
@@ -3,6 +3,7 @@ import json
 import logging
 
 from switchboard.engine import EngineError
+from switchboard.stats import format_stats
 
 logger = logging.getLogger(__name__)
 
@@ -162,6 +163,13 @@ class CommandDecoder:
             logger.warning('Invalid set target "{}"'.format(target))
             self.help_get()
 
+    def stats(self, args):
+        text = format_stats(self._engine, args[0].lower())
+        if text is None:
+            yield self.response_error('Unkown stats command "{}"'.format(args[0]))
+        else:
+            yield self.response_text(text, finished=True)
+
     def start(self, args):
         self._engine.running = True
         self._config.set('running', True)
@@ -3,7 +3,8 @@ import os
 import json
 import logging
 
-from switchboard.utils import get_input, is_float
+from switchboard.utils import get_input, is_float, is_int
+from switchboard.scheduler import OVERRUN_POLICIES
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +15,8 @@ logger = logging.getLogger(__name__)
 # * limit: a human readable description of the acceptable option
 #       value limits
 # * type: the type of the option
+# * default: optional value used if the option is not set in the config
+#       file. Options without a default must be present in the config file
 CONFIG_OPTS = {
         'poll_period': {
             'desc': 'polling period in seconds',
@@ -36,6 +39,34 @@ CONFIG_OPTS = {
             'limit': 'an int > 0 and < 65536',
             'type': int
         },
+        'push_host': {
+            'desc': 'interface the server receiving the values pushed by clients listens on',
+            'test': lambda x: len(x) > 0,
+            'limit': 'a hostname or IP address',
+            'type': str,
+            'default': 'localhost'
+        },
+        'push_port': {
+            'desc': 'port the server receiving the values pushed by clients listens on, 0 picks a free port',
+            'test': lambda x: is_int(x) and x >= 0 and x < 65536,
+            'limit': 'an int >= 0 and < 65536',
+            'type': int,
+            'default': 0
+        },
+        'ws_queue_size': {
+            'desc': 'number of messages that may be waiting to be sent to a ws_ctrl or iodata client',
+            'test': lambda x: is_int(x) and int(x) >= 1,
+            'limit': 'an int >= 1',
+            'type': str,
+            'default': '100'
+        },
+        'ws_coalesce_threshold': {
+            'desc': 'number of queued messages above which the pending updates of an iodata client are merged',
+            'test': lambda x: is_int(x) and int(x) >= 1,
+            'limit': 'an int >= 1',
+            'type': str,
+            'default': '10'
+        },
         'apps': {
             'test': lambda x: isinstance(x, dict),
             'limit': 'a dict',
@@ -50,6 +81,97 @@ CONFIG_OPTS = {
             'test': lambda x: isinstance(x, dict),
             'limit': 'a dict',
             'type': dict
+        },
+        'poll_workers': {
+            'desc': 'number of clients polled concurrently',
+            'test': lambda x: is_int(x) and int(x) >= 1,
+            'limit': 'an int >= 1',
+            'type': str,
+            'default': '1'
+        },
+        'write_workers': {
+            'desc': 'number of threads writing outputs to clients',
+            'test': lambda x: is_int(x) and int(x) >= 1,
+            'limit': 'an int >= 1',
+            'type': str,
+            'default': '1'
+        },
+        'module_workers': {
+            'desc': 'number of independent groups of modules evaluated concurrently',
+            'test': lambda x: is_int(x) and int(x) >= 1,
+            'limit': 'an int >= 1',
+            'type': str,
+            'default': '1'
+        },
+        'module_time_budget': {
+            'desc': 'default time in seconds a module evaluation may take, 0 for no limit',
+            'test': lambda x: is_float(x) and float(x) >= 0,
+            'limit': 'a float >= 0',
+            'type': str,
+            'default': '0'
+        },
+        'module_max_overruns': {
+            'desc': 'default number of consecutive time budget overruns after which a module is disabled, 0 to never disable',
+            'test': lambda x: is_int(x) and int(x) >= 0,
+            'limit': 'an int >= 0',
+            'type': str,
+            'default': '0'
+        },
+        'watchdog_timeout': {
+            'desc': 'time in seconds after which a tick that is still running is reported, 0 to disable',
+            'test': lambda x: is_float(x) and float(x) >= 0,
+            'limit': 'a float >= 0',
+            'type': str,
+            'default': '10'
+        },
+        'tick_overrun_policy': {
+            'desc': 'what to do with missed ticks: "skip" or "catch_up"',
+            'test': lambda x: x in OVERRUN_POLICIES,
+            'limit': 'one of {}'.format(OVERRUN_POLICIES),
+            'type': str,
+            'default': 'skip'
+        },
+        'client_min_timeout': {
+            'desc': 'lower bound in seconds of the timeouts derived from the latency of a client',
+            'test': lambda x: is_float(x) and float(x) > 0,
+            'limit': 'a float > 0',
+            'type': str,
+            'default': '0.2'
+        },
+        'client_max_timeout': {
+            'desc': 'upper bound in seconds of the timeouts derived from the latency of a client',
+            'test': lambda x: is_float(x) and float(x) > 0,
+            'limit': 'a float > 0',
+            'type': str,
+            'default': '5'
+        },
+        'client_failure_threshold': {
+            'desc': 'number of failed polls in a row after which a client is only probed now and then',
+            'test': lambda x: is_int(x) and int(x) >= 1,
+            'limit': 'an int >= 1',
+            'type': str,
+            'default': '3'
+        },
+        'client_max_backoff': {
+            'desc': 'max time in seconds between probes of a client that keeps failing',
+            'test': lambda x: is_float(x) and float(x) >= 1,
+            'limit': 'a float >= 1',
+            'type': str,
+            'default': '60'
+        },
+        'client_probe_timeout': {
+            'desc': 'timeout in seconds when probing a client that keeps failing',
+            'test': lambda x: is_float(x) and float(x) > 0,
+            'limit': 'a float > 0',
+            'type': str,
+            'default': '0.5'
+        },
+        'http_connections': {
+            'desc': 'max number of keep-alive connections per client',
+            'test': lambda x: is_int(x) and int(x) >= 1,
+            'limit': 'an int >= 1',
+            'type': str,
+            'default': '2'
         }
 }
 
@@ -61,8 +183,11 @@ class SwitchboardConfig:
         # Create an empty config to be used if no config file is provided
         self.configs = {}
         for key, opt in CONFIG_OPTS.items():
-            args = ()
-            self.configs[key] = opt['type'](*args)
+            if 'default' in opt:
+                self.configs[key] = opt['default']
+            else:
+                args = ()
+                self.configs[key] = opt['type'](*args)
 
         # Sets default poll period. Without this value Switchboard can't start
         self.configs['poll_period'] = "1.0"
@@ -165,6 +290,9 @@ class SwitchboardConfig:
 
         # Loop through every parameter and check that it exists and is valid
         for key, opt in CONFIG_OPTS.items():
+            if not key in self.configs and 'default' in opt:
+                self.configs[key] = opt['default']
+
             if not key in self.configs:
                 msg = 'Config parameter "{}" not in config file'.format(key)
                 raise Exception(msg)
@@ -1,9 +1,22 @@
 
 from datetime import datetime
 import logging
+import sys
+import time
 
 logger = logging.getLogger(__name__)
 
+
+# Offset of the wall-clock from the monotonic clock at start-up. The device
+# update times are monotonic and only converted for display using a fixed
+# offset so that the displayed time of a device doesn't change on its own.
+_WALL_CLOCK_OFFSET = time.time() - time.monotonic()
+
+
+def get_update_datetime(update_time):
+    ''' Converts a monotonic device update time into a datetime '''
+    return datetime.fromtimestamp(update_time + _WALL_CLOCK_OFFSET)
+
 def get_device_suffix(name):
     ''' Gets the device suffix indicating device type ('.i' for input,
         '.o' for output and '.io' for input+output. Return None in case
@@ -22,7 +35,13 @@ def get_device_suffix(name):
 
 
 class SwitchboardDevice(object):
+    # There can be a large number of devices so they don't get a __dict__
+    __slots__ = ( 'name', 'value', 'previous_value', 'last_set_value', 'is_input',
+                  'is_output', 'error', 'input_signal', 'output_signal', 'last_update_time' )
+
     class BaseSignal(object):
+        __slots__ = ( '_device', )
+
         def __init__(self, device):
             self._device = device
 
@@ -35,6 +54,8 @@ class SwitchboardDevice(object):
 
     class InputSignal(BaseSignal):
         ''' Switchboard module facing input signal '''
+        __slots__ = ()
+
         def get_value(self):
             return self._device.value
 
@@ -44,19 +65,22 @@ class SwitchboardDevice(object):
 
     class OutputSignal(BaseSignal):
         ''' Switchboard module facing output signal '''
+        __slots__ = ( 'driving_module', )
+
         def __init__(self, device):
             super(SwitchboardDevice.OutputSignal, self).__init__(device)
             self.driving_module = None
 
         def set_value(self, value):
             logger.info('Setting value of {} to {}'.format(self._device.name, value))
-            self._device.last_update_time = datetime.now()
+            self._device.last_update_time = time.monotonic()
             self._device.last_set_value = value
             self._device.set_value(value)
 
 
     def __init__(self, name):
-        self.name = name
+        # Device names are used as keys all over the engine
+        self.name = sys.intern(name)
 
         # Used by input devices
         self.value = None
@@ -72,7 +96,9 @@ class SwitchboardDevice(object):
 
         self.input_signal = None
         self.output_signal = None
-        self.last_update_time = datetime.now()
+
+        # Monotonic time of the last value change, see get_update_datetime()
+        self.last_update_time = time.monotonic()
 
 
     def create_input_signal(self):
@@ -88,7 +114,7 @@ class SwitchboardDevice(object):
     def update_value(self, value):
         ''' To be called by the Switchboard engine when an input is updated'''
         if self.value != value:
-            self.last_update_time = datetime.now()
+            self.last_update_time = time.monotonic()
         self.previous_value = self.value
         self.value = value
 
@@ -108,6 +134,8 @@ class SwitchboardDevice(object):
 
 
 class SignalDevice(SwitchboardDevice):
+    __slots__ = ( 'on_change', )
+
     def __init__(self, name):
         device_name_suffix = get_device_suffix(name)
         if device_name_suffix != 's':
@@ -120,13 +148,21 @@ class SignalDevice(SwitchboardDevice):
         self.create_input_signal()
         self.create_output_signal()
 
+        # Optional callback called with the device whenever its value changes
+        self.on_change = None
+
 
     def set_value(self, value):
+        changed = self.value != value
         self.value = value
+        if changed and self.on_change:
+            self.on_change(self)
 
 
 
 class RESTDevice(SwitchboardDevice):
+    __slots__ = ( 'client_url', '_set_value_callback' )
+
     def __init__(self, device, client_url, set_value_callback):
         device_name_suffix = get_device_suffix(device['name'])
         if not device_name_suffix in ['i', 'o', 'io']:
@@ -1,26 +1,60 @@
 
 import sys
 import time
+import threading
 import json
 import importlib
 import requests
 import logging
 
-from threading import Lock, Thread
+from threading import Thread
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
-from switchboard.device import RESTDevice
+from switchboard.circuit_breaker import CircuitBreaker
+from switchboard.device import RESTDevice, SignalDevice
 from switchboard.module import SwitchboardModule
+from switchboard.module_graph import ModuleGraph
+from switchboard.scheduler import PollScheduler, TickTimer
+from switchboard.value_store import ColumnarRESTDevice, ColumnarSignalDevice
+from switchboard.stats import TimedLock, TimingStats, PhaseTimer, LatencyEstimator
+from switchboard.output_writer import OutputWriter
 from switchboard.utils import load_attribute
 
 
 logging.getLogger('requests').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Period in seconds at which the statistics are sent to the ws_ctrl clients
+STATS_BROADCAST_PERIOD = 5.0
+
+# Number of client pushes that may be waiting to be applied
+MAX_PENDING_PUSHES = 1000
+
+# The phases of a tick, in order
+TICK_PHASES = [ 'sleep', 'poll', 'apply', 'modules', 'outputs', 'snapshot' ]
+
 def prints(fs, val):
     logger.info(val)
     fs(val)
 
 
+def create_http_session(pool_size):
+    ''' Creates a requests session that keeps up to pool_size connections
+        to a client alive so that consecutive polls and output writes
+        reuse a warm socket instead of opening a new connection. Blocks
+        rather than exceeding pool_size connections to the client. '''
+    session = requests.Session()
+    adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 class EngineError(Exception):
     def __init__(self, msg=''):
         self.msg = msg
@@ -32,7 +66,7 @@ class EngineError(Exception):
 
 
 class SwitchboardEngine(object):
-    def __init__(self, config, ws_ctrl):
+    def __init__(self, config, ws_ctrl, value_store=None):
         # Determines if the SwitchboardEngine logic is running or not
         self.running = False
 
@@ -54,11 +88,85 @@ class SwitchboardEngine(object):
         # Map of all the Switchboard devices (name -> device instance)
         self.devices = {}
 
-        # Lock used to synchronise switchboard with its settings
-        self.lock = Lock()
-
-        # Let the engine know how long since the last cycle
-        self.prev_cycle_time = 0.0
+        # Optional columnar ValueStore holding the device values. If None
+        # the values are kept in the device objects.
+        self._value_store = value_store
+
+        # Indexes of device name -> names of the modules that use the
+        # device as an input or as an output
+        self._input_index = {}
+        self._output_index = {}
+
+        # Dataflow graph of the modules which determines the order in
+        # which they are evaluated
+        self._module_graph = ModuleGraph()
+
+        # Names of the devices whose value, output or error state changed
+        # since the last snapshot. Only these are sent to ws_ctrl.
+        self._changed_devices = set()
+
+        # Devices whose value changed since the modules were last
+        # evaluated. Their previous value is brought up to date before
+        # the next values are applied so that a change is only reported
+        # once by InputSignal.has_changed(), even if their client isn't
+        # polled again.
+        self._unaged_devices = set()
+
+        # False if the clients polled this tick were only the ones with
+        # their own poll period that were due before the next tick
+        self._global_tick = True
+
+        # Values pushed by the clients waiting to be applied by the engine
+        # thread, as (monotonic time, values json) tuples. Pushes set the
+        # event to interrupt the engine's sleep.
+        self._pushed_values = deque()
+        self._wakeup = threading.Event()
+
+        # Names of the modules due to be evaluated because one of their
+        # inputs changed. Modules with the 'on_change' trigger only run
+        # if they are in this set.
+        self._triggered_modules = set()
+
+        # Lock used to synchronise switchboard with its settings. It keeps
+        # track of the lock wait and hold times.
+        self.lock = TimedLock()
+
+        # Keeps the engine ticking at the poll period
+        self._tick_timer = TickTimer()
+
+        # Schedule of the clients that have their own poll period
+        self._scheduler = PollScheduler()
+
+        # Writes the output values to the clients in the background
+        self._output_writer = OutputWriter(self._write_client_outputs)
+
+        # Worker pool used to poll clients concurrently. Only created
+        # if more than one poll worker is configured
+        self._poll_pool = None
+        self._poll_pool_size = 0
+
+        # Worker pool used to evaluate independent groups of modules
+        # concurrently. Only created if more than one module worker is
+        # configured
+        self._module_pool = None
+        self._module_pool_size = 0
+
+        # Default module time budget and max overruns from the config
+        self._module_budget_defaults = (0.0, 0)
+
+        # Used by the watchdog: monotonic start time of the tick in
+        # progress and the modules being evaluated (thread id -> (module
+        # name, monotonic start time))
+        self._tick_start_time = None
+        self._running_modules = {}
+        self._watchdog_reported = None
+        self.watchdog_alerts = 0
+
+        # Monotonic time the statistics were last sent to ws_ctrl
+        self._last_stats_broadcast = 0.0
+
+        # Time spent in every phase of the recent ticks
+        self._tick_phases = PhaseTimer(TICK_PHASES)
 
     def init_clients(self):
         ''' Initialise the switchboard clients according to the config file '''
@@ -120,10 +228,22 @@ class SwitchboardEngine(object):
             the strong exception guarantee (i.e., if an error is raised
             SwitchboardEngine will keep running without changing state) '''
 
+        # The session is only kept if the client is successfully added
+        session = create_http_session(int(self.config.get('http_connections') or 1))
+        try:
+            self._upsert_client_with_session(client_url, client_alias,
+                    poll_period, log_prefix, print_func, session)
+        except:
+            session.close()
+            raise
+
+
+    def _upsert_client_with_session(self, client_url, client_alias, poll_period,
+            log_prefix, print_func, session):
         # Get the info of all the devices
         info_url = client_url + '/devices_info'
         try:
-             req = requests.get(info_url, timeout=3).json()
+             req = session.get(info_url, timeout=float(self.config.get('client_max_timeout') or 5)).json()
         except Exception as e:
             raise EngineError('Unable to connect to {}: {}'.format(info_url, e))
 
@@ -135,24 +255,32 @@ class SwitchboardEngine(object):
 
         new_devices = {}
 
-        for device in client_devices:
-            # Preprend the client name to the device name so that identical
-            # devices on different clients have different names
-            name = '{}.{}'.format(client_alias, device['name'])
-            device['name'] = name
-
-            # Check we don't have duplicate devices on this client
-            if name in new_devices:
-                raise EngineError('Device "{}" exists twice on client {}'.format(name, client_url))
-
-            # Make sure we don't add a device that already exists on a
-            # different client
-            if name in self.devices and self.devices[name].client_url != client_url:
-                clashing_client = self.devices[name].client_url
-                raise EngineError('Device "{}" already exists for client {}'.format(name, clashing_client))
-
-            new_devices[name] = RESTDevice(device, client_url, self.set_remote_device_value)
-            prints(print_func, '{}\t{}'.format(log_prefix, name))
+        try:
+            for device in client_devices:
+                # Preprend the client name to the device name so that identical
+                # devices on different clients have different names
+                name = '{}.{}'.format(client_alias, device['name'])
+                device['name'] = name
+
+                # Check we don't have duplicate devices on this client
+                if name in new_devices:
+                    raise EngineError('Device "{}" exists twice on client {}'.format(name, client_url))
+
+                # Make sure we don't add a device that already exists on a
+                # different client
+                if name in self.devices and self.devices[name].client_url != client_url:
+                    clashing_client = self.devices[name].client_url
+                    raise EngineError('Device "{}" already exists for client {}'.format(name, clashing_client))
+
+                new_device = self._create_rest_device(device, client_url)
+                new_devices[new_device.name] = new_device
+                prints(print_func, '{}\t{}'.format(log_prefix, name))
+        except:
+            # The devices created so far hold rows in the value store
+            if self._value_store:
+                for new_device in new_devices.values():
+                    new_device.release()
+            raise
 
         # In case we are updating a client we need to delete all its
         # known 'old' devices and remove it from the clients dict
@@ -163,10 +291,19 @@ class SwitchboardEngine(object):
 
         # And now add all the new/updated client information
         self.devices.update(new_devices)
-        self.clients[client_alias] = _ClientInfo(client_url, client_alias, new_devices, poll_period)
+        client = _ClientInfo(client_url, client_alias, new_devices, poll_period, session)
+        client.compile_ingest_plan()
+        self.clients[client_alias] = client
+
+        # The modules using this client now use new devices
+        for name in new_devices:
+            self._on_device_error_changed(name)
 
         # Load the initial values
-        self._update_devices_values()
+        self._update_devices_values([client])
+
+        if poll_period:
+            self._scheduler.add(client_alias, float(poll_period))
 
         # Let ws_ctrl now we may have a new table structure
         self._ws_ctrl.reset_table()
@@ -177,14 +314,10 @@ class SwitchboardEngine(object):
 
         client_obj = self.clients[client_alias]
 
-        # Figure out which modules are using the IOs from this client
         modules_using_client = set()
-        for mod_name, mod_obj in self.modules.items():
-            ios = set(mod_obj.module_class.inputs) | set(mod_obj.module_class.outputs)
-            for device in client_obj.devices:
-                if device in ios:
-                    modules_using_client.add(mod_name)
-                    break
+        for device in client_obj.devices:
+            modules_using_client.update(self._input_index.get(device, ()))
+            modules_using_client.update(self._output_index.get(device, ()))
 
         return modules_using_client
 
@@ -194,29 +327,120 @@ class SwitchboardEngine(object):
             delete the devices associated with this client '''
 
         for old_device in self.clients[client_alias].devices:
+            if self._value_store:
+                self.devices[old_device].release()
             del self.devices[old_device]
+        self.clients[client_alias].session.close()
+        self._scheduler.remove(client_alias)
+        self._output_writer.remove(self.clients[client_alias])
         del self.clients[client_alias]
 
         # Let ws_ctrl now we may have a new table structure
         self._ws_ctrl.reset_table()
 
 
+    def _create_rest_device(self, device, client_url):
+        if self._value_store:
+            return ColumnarRESTDevice(self._value_store, device, client_url, self.set_remote_device_value)
+        return RESTDevice(device, client_url, self.set_remote_device_value)
+
+
+    def _create_signal_device(self, name):
+        if self._value_store:
+            return ColumnarSignalDevice(self._value_store, name)
+        return SignalDevice(name)
+
+
     def upsert_switchboard_module(self, module_name, enabled=False):
         # Instantiate the module and update data structures
         logger.info('Adding module {}'.format(module_name))
         swbmodule = load_attribute(module_name)
         swbmodule.module_class.enabled = enabled
+        if module_name in self.modules:
+            self._unindex_module(module_name, self.modules[module_name].module_class)
+            self.modules[module_name].module_class.shutdown()
         self.modules[module_name] = swbmodule
+        self._index_module(module_name, swbmodule.module_class)
+
+        swbmodule.module_class.set_budget_defaults(*self._module_budget_defaults)
 
         # Make sure all the inputs and outputs line up correctly
-        swbmodule.module_class.create_argument_list(self.devices)
+        try:
+            swbmodule.module_class.create_argument_list(self.devices, self._create_signal_device)
+        finally:
+            self._update_module_graph()
+
+        # Internal signals let the engine know when modules change them
+        for name in list(swbmodule.module_class.inputs) + list(swbmodule.module_class.outputs):
+            if isinstance(self.devices.get(name), SignalDevice):
+                self.devices[name].on_change = self._on_signal_changed
 
 
     def remove_module(self, module_name):
+        self._unindex_module(module_name, self.modules[module_name].module_class)
+        self.modules[module_name].module_class.shutdown()
         del self.modules[module_name]
+        self._update_module_graph()
         logger.info('Removed module {}'.format(module_name))
 
 
+    def _update_module_graph(self):
+        ''' Rebuild the module dataflow graph after the modules changed '''
+        self._module_graph = ModuleGraph([ (name, module.module_class)
+                                           for name, module in self.modules.items() ])
+        for cycle in self._module_graph.cycles:
+            logger.warning('Modules {} depend on each other in a cycle, their outputs may '
+                           'take several ticks to settle'.format(', '.join(cycle)))
+
+
+    def get_module_graph(self):
+        return self._module_graph
+
+
+    def _index_module(self, module_name, module_class):
+        ''' Adds the module to the device -> module indexes. A new module
+            is always evaluated at least once. '''
+        for name in module_class.inputs:
+            self._input_index.setdefault(name, set()).add(module_name)
+        for name in module_class.outputs:
+            self._output_index.setdefault(name, set()).add(module_name)
+        self._triggered_modules.add(module_name)
+
+
+    def _unindex_module(self, module_name, module_class):
+        for index, names in ((self._input_index, module_class.inputs),
+                             (self._output_index, module_class.outputs)):
+            for name in names:
+                modules = index.get(name)
+                if modules:
+                    modules.discard(module_name)
+                    if not modules:
+                        del index[name]
+        self._triggered_modules.discard(module_name)
+
+
+    def _on_device_value_changed(self, device_name):
+        ''' Record the change for the next snapshot and trigger the
+            modules that use the device as an input '''
+        self._changed_devices.add(device_name)
+        modules = self._input_index.get(device_name)
+        if modules:
+            self._triggered_modules.update(modules)
+
+
+    def _on_device_error_changed(self, device_name):
+        ''' Trigger the modules that use the device as an input or output
+            as their error state may change '''
+        self._on_device_value_changed(device_name)
+        modules = self._output_index.get(device_name)
+        if modules:
+            self._triggered_modules.update(modules)
+
+
+    def _on_signal_changed(self, device):
+        self._on_device_value_changed(device.name)
+
+
     def enable_switchboard_module(self, module_name):
         if not module_name in self.modules:
             raise EngineError('Unknown module {}'.format(module_name))
@@ -227,7 +451,9 @@ class SwitchboardEngine(object):
             logger.warning('Module {} enabled but will not run due to error: {}'.format(
                 module_name, module_class.error))
 
+        module_class.clear_time_budget_error()
         module_class.enabled = True
+        self._triggered_modules.add(module_name)
 
 
     def disable_switchboard_module(self, module_name):
@@ -243,6 +469,41 @@ class SwitchboardEngine(object):
         self._swb_thread.daemon = True
         self._swb_thread.start()
 
+        watchdog_thread = Thread(target=self._watchdog)
+        watchdog_thread.daemon = True
+        watchdog_thread.start()
+
+
+    def _watchdog(self):
+        ''' Reports ticks that take longer than the watchdog timeout. The
+            engine can't interrupt a module that hangs, but this at least
+            tells which module is holding up the engine. '''
+        while not self.terminate:
+            timeout = float(self.config.get('watchdog_timeout') or 0)
+            time.sleep(min(timeout, 1.0) if timeout else 1.0)
+            if timeout:
+                self._check_watchdog(timeout)
+
+
+    def _check_watchdog(self, timeout):
+        ''' Logs an error, once per tick, if the tick in progress has been
+            running for longer than timeout seconds '''
+        tick_start_time = self._tick_start_time
+        if tick_start_time is None or tick_start_time == self._watchdog_reported:
+            return
+
+        now = time.monotonic()
+        if now - tick_start_time <= timeout:
+            return
+
+        self._watchdog_reported = tick_start_time
+        self.watchdog_alerts += 1
+
+        running = [ '{} (running for {:.1f}s)'.format(name, now - start_time)
+                    for name, start_time in list(self._running_modules.values()) ]
+        logger.error('Tick has been running for {:.1f}s. {}'.format(now - tick_start_time,
+            'Modules running: ' + ', '.join(running) if running else 'No module is running'))
+
 
     def run(self):
         while not self.terminate:
@@ -256,76 +517,547 @@ class SwitchboardEngine(object):
     def switchboard_loop(self):
         ''' Execute one loop/tick/clk of the Switchboard engine '''
 
-        # Wait to complete the poll period
-        poll_period = float(self.config.configs['poll_period'])
-        time_diff = time.time() - self.prev_cycle_time
-        sleep_time = max(0.0, poll_period - time_diff)
-        time.sleep(sleep_time)
-        self.prev_cycle_time = time.time()
+        self._tick_phases.start()
+
+        # Wait to complete the poll period, for the next client to be due
+        # or for a client to push its values
+        self._wakeup.wait(self._get_sleep_time())
+        self._wakeup.clear()
+
+        clients = self._start_tick()
+
+        # Fetch the latest values without holding the lock so that cli
+        # actions aren't blocked by slow clients
+        results = self._poll_clients(clients)
+
+        self._end_tick(clients, results)
+
+
+    def _start_tick(self):
+        ''' First part of a tick, once the engine is done sleeping.
+            Returns the clients to poll. '''
+        self._tick_start_time = time.monotonic()
+        self._tick_phases.mark('sleep')
+
+        with self.lock:
+            return self._get_due_clients()
+
+
+    def _end_tick(self, clients, results):
+        ''' Rest of a tick once the clients have been polled '''
+        phases = self._tick_phases
+        phases.mark('poll')
 
         # Lock so that cli actions don't interfere
         with self.lock:
-            # Get all the latest values
-            self._update_devices_values()
+            # Apply the latest values. Values pushed while a client was
+            # being polled are more recent than the values it returned.
+            older_pushes, newer_pushes = self._take_pushed_values(clients)
+            self._age_devices()
+            self._apply_pushed_values(older_pushes)
+            self._apply_poll_results(clients, results)
+            self._apply_pushed_values(newer_pushes)
+            phases.mark('apply')
+
+            # Evaluate the modules if we're running. In between ticks, when
+            # only clients with their own poll period were polled, only
+            # the modules using devices that changed are evaluated.
+            self._evaluate_modules(triggered_only=not self._global_tick)
+
+            writes = self._take_pending_writes()
+            changed = self._take_changed_devices()
+        phases.mark('modules')
+
+        # Queue the outputs set during this tick, one request per client
+        self._write_outputs(writes)
+        phases.mark('outputs')
+
+        self._finish_tick(changed)
+        phases.mark('snapshot')
+
+
+    def _finish_tick(self, changed):
+        ''' Update the ws_ctrl agents at the end of a tick '''
+        self._ws_ctrl.take_snapshot(self.clients, self.devices, changed)
+        self._tick_start_time = None
+
+        now = time.monotonic()
+        if now - self._last_stats_broadcast >= STATS_BROADCAST_PERIOD:
+            self._last_stats_broadcast = now
+            self._ws_ctrl.send_stats({ 'modules': self.get_module_stats() })
+
+
+    def _take_changed_devices(self):
+        ''' Returns the names of the devices that changed since the last
+            call so that ws_ctrl only needs to look at those. With a value
+            store they are found in one go. Must be called while holding
+            the lock. '''
+        changed = self._changed_devices
+        self._changed_devices = set()
+        if self._value_store:
+            changed = set(device.name for device in self._value_store.take_changes())
+        return changed
+
+
+    def get_engine_stats(self):
+        ''' Returns the time spent in each phase of the recent ticks and
+            the poll latency and failure counts of every client '''
+        return {
+            'phases': self._tick_phases.get_stats(),
+            'clients': { alias: self._get_client_stats(client) for alias, client in list(self.clients.items()) }
+        }
+
+
+    def _get_client_stats(self, client):
+        client_stats = client.get_poll_stats()
+        client_stats['timeout'] = self._get_client_timeout(client)
+        return client_stats
+
+
+    def get_module_stats(self):
+        ''' Returns the call counts and runtime statistics of every module '''
+        return { name: module.module_class.get_stats() for name, module in list(self.modules.items()) }
+
+
+    def _get_sleep_time(self):
+        ''' Time left until the next tick or until the next client with
+            its own poll period is due '''
+        sleep_time = self._tick_timer.time_until_tick()
+
+        next_due = self._scheduler.next_due()
+        if next_due is not None:
+            sleep_time = min(sleep_time, next_due - time.monotonic())
+
+        return max(0.0, sleep_time)
+
+
+    def _get_due_clients(self):
+        ''' Returns the clients that should be polled this tick. Clients
+            without a poll period are polled once every poll period, the
+            other clients whenever their own poll period is due. '''
+        clients = []
+
+        self._global_tick = self._tick_timer.is_due()
+        if self._global_tick:
+            self._tick_timer.tick(float(self.config.configs['poll_period']),
+                    self.config.get('tick_overrun_policy') or 'skip')
+            clients = [ c for c in self.clients.values() if c.poll_period is None ]
+
+        for alias in self._scheduler.pop_due():
+            clients.append(self.clients[alias])
+
+        # Clients that keep failing are only probed once their backoff
+        # has expired
+        now = time.monotonic()
+        due_clients = []
+        for client in clients:
+            if client.breaker.allow_request(now):
+                due_clients.append(client)
+            else:
+                self._scheduler.reschedule(client.alias, now)
+
+        return due_clients
+
+
+    def get_tick_stats(self):
+        ''' Returns the tick jitter and overrun counts '''
+        return self._tick_timer.get_stats()
+
+
+    def _evaluate_modules(self, triggered_only=False):
+        ''' Evaluate the modules if the engine is running. Modules with
+            the 'on_change' trigger, or all the modules if triggered_only
+            is set, are only evaluated if they have been triggered by a
+            change to one of their devices. '''
+        if not self.running:
+            return
+
+        self._update_module_budget_defaults()
+
+        # Modules that don't share any devices can run concurrently so
+        # that a slow module doesn't hold up unrelated modules
+        components = self._module_graph.components
+        pool = self._get_module_pool()
+        if pool is None or len(components) <= 1:
+            self._evaluate_module_group(self._module_graph.order, triggered_only)
+        else:
+            list(pool.map(lambda names: self._evaluate_module_group(names, triggered_only), components))
+
+
+    def _evaluate_module_group(self, module_names, triggered_only):
+        ''' Evaluate the given modules one after the other '''
+        triggered = self._triggered_modules
+        thread_id = threading.get_ident()
+        try:
+            for module_name in module_names:
+                module = self.modules[module_name]
+                if triggered_only or module.module_class.trigger == 'on_change':
+                    if not module_name in triggered:
+                        continue
+                triggered.discard(module_name)
+                self._running_modules[thread_id] = (module_name, time.monotonic())
+                module()
+        finally:
+            self._running_modules.pop(thread_id, None)
+
+
+    def _update_module_budget_defaults(self):
+        ''' Pass the default module time budget to the modules whenever
+            it changes in the config '''
+        defaults = (float(self.config.get('module_time_budget') or 0),
+                    int(self.config.get('module_max_overruns') or 0))
+        if defaults != self._module_budget_defaults:
+            self._module_budget_defaults = defaults
+            for module in self.modules.values():
+                module.module_class.set_budget_defaults(*defaults)
+
+
+    def push_client_values(self, values_json):
+        ''' Queue device values pushed by a client and wake the engine up
+            so that the modules that use them are evaluated straight away
+            rather than at the next tick. The values are applied by the
+            engine thread. The client is identified by the epoch it
+            reported when it was last polled. Returns an error message or
+            None if the values were queued. '''
+
+        client = self._get_client_by_epoch(values_json.get('epoch'))
+        if not client:
+            return 'Unknown client epoch "{}", the client must be polled first'.format(
+                    values_json.get('epoch'))
+
+        error = self._check_values_json_formatting(client.url, values_json)
+        if error:
+            return error
+
+        if len(self._pushed_values) >= MAX_PENDING_PUSHES:
+            return 'Switchboard is busy, {} pushes are waiting to be applied'.format(
+                    len(self._pushed_values))
+
+        self._pushed_values.append((time.monotonic(), values_json))
+        self._wakeup.set()
+
+
+    def _take_pushed_values(self, clients):
+        ''' Returns the values pushed since the last call, split into the
+            pushes made before the given clients were polled and the
+            others. Each push is a (client, values_json) tuple. '''
+        older = []
+        newer = []
+        while self._pushed_values:
+            push_time, values_json = self._pushed_values.popleft()
+            client = self._get_client_by_epoch(values_json.get('epoch'))
+            if not client:
+                logger.warning('Dropping values pushed by a client that is no longer known')
+            elif client in clients and push_time < client.poll_started:
+                older.append((client, values_json))
+            else:
+                newer.append((client, values_json))
+        return older, newer
+
+
+    def _apply_pushed_values(self, pushes):
+        for client, values_json in pushes:
+            _, error = self._ingest_client_values(client, values_json['devices'])
+            if error:
+                logger.warning('Pushed values: {}'.format(error))
+
+
+    def _get_client_by_epoch(self, epoch):
+        if epoch is None:
+            return None
+
+        for client in list(self.clients.values()):
+            if client.epoch == epoch:
+                return client
+        return None
+
 
-            # Evaluate the modules if we're running
-            if self.running:
-                for module in self.modules.values():
-                    module()
+    def _get_module_pool(self):
+        ''' Returns the worker pool used to evaluate modules or None if
+            the modules are evaluated in the engine thread '''
 
-        # Update ws_ctrl agents
-        self._ws_ctrl.take_snapshot(self.clients, self.devices)
+        workers = int(self.config.get('module_workers') or 1)
+        if workers <= 1:
+            return None
+
+        if workers != self._module_pool_size:
+            if self._module_pool:
+                self._module_pool.shutdown(wait=False)
+            self._module_pool = ThreadPoolExecutor(max_workers=workers)
+            self._module_pool_size = workers
+
+        return self._module_pool
 
 
     def set_remote_device_value(self, device, value):
+        ''' Buffers the value of an output device. The buffered outputs
+            are written at the end of the tick so that every client gets
+            at most one request per tick. If an output is set several
+            times before it is written only the latest value is sent. '''
+
+        client_alias = device.name[:device.name.find('.')]
+        if not client_alias in self.clients:
+            logger.error('Unable to set the output value of {} to {}: unknown client {}'.format(
+                device.name, value, client_alias))
+            return
+
         # Strip the client alias from the device name so that the remote
         # client recognises its local device
         local_device_name = device.name[device.name.find('.') + 1:]
-        payload = json.dumps({'name': local_device_name, 'value': str(value)})
-        try:
-            r = requests.put(device.client_url + '/device_set', data=payload, timeout=1)
-            response = r.json()
-            if 'error' in response:
-                logger.warning(response['error'])
-        except Exception as e:
-            logger.error('Exception "{}" when setting the output value of {} to {}'.format(
-                e, device.name, value))
+        self.clients[client_alias].pending_writes[local_device_name] = value
+        self._changed_devices.add(device.name)
+
 
+    def get_output_stats(self):
+        ''' Returns the output queue depth, write latency and counters '''
+        return self._output_writer.get_stats()
 
-    def _update_devices_values(self):
-        ''' Get updated values from the devices '''
 
+    def _take_pending_writes(self):
+        ''' Returns a list of (client, {device name: value}) tuples for
+            all the buffered outputs and clears the buffers. Must be
+            called while holding the lock. '''
+
+        writes = []
         for client in self.clients.values():
-            if not client.do_update():
-                continue
+            if client.pending_writes:
+                writes.append((client, client.pending_writes))
+                client.pending_writes = {}
+        return writes
+
+
+    def _write_outputs(self, writes):
+        ''' Hand the buffered outputs returned by _take_pending_writes to
+            the output writer. The values are written in the background so
+            this never waits on the network. '''
+        self._output_writer.set_workers(int(self.config.get('write_workers') or 1))
+        self._output_writer.submit(writes)
 
-            values_url = client.url + '/devices_value'
 
+    def _write_client_outputs(self, client, writes):
+        ''' Write all the buffered outputs of a client with a single
+            request. Falls back to one request per output for clients
+            that don't support batched writes. Returns False if the
+            client could not be reached. '''
+
+        if client.batch_writes:
+            devices = [ {'name': name, 'value': str(value)} for name, value in writes.items() ]
+            payload = json.dumps({'devices': devices})
             try:
-                values = requests.get(values_url, timeout=5)
-                client.connected = True
-            except:
-                client.connected = False
-                client.on_error('Unable to access client {}'.format(client.url))
-                continue
+                r = self._client_request(client, client.session.put, client.url + '/devices_set', data=payload)
+            except Exception as e:
+                logger.error('Exception "{}" when setting the output values of client {}'.format(
+                    e, client.url))
+                return False
 
+            if r.status_code in (404, 405):
+                logger.info('Client {} does not support batched output writes'.format(client.url))
+                client.batch_writes = False
+            else:
+                self._check_write_response(r)
+                return True
+
+        for name, value in writes.items():
+            payload = json.dumps({'name': name, 'value': str(value)})
             try:
-                values_json = values.json()
-            except:
-                client.on_error('Invalid json formatting for client {}'.format(url))
-                continue
+                r = self._client_request(client, client.session.put, client.url + '/device_set', data=payload)
+            except Exception as e:
+                logger.error('Exception "{}" when setting the output value of {}.{} to {}'.format(
+                    e, client.alias, name, value))
+                return False
+            self._check_write_response(r)
+
+        return True
+
+
+    def _check_write_response(self, r):
+        try:
+            response = r.json()
+        except Exception:
+            logger.warning('Invalid json response when setting outputs of {}'.format(r.url))
+            return
+
+        if 'error' in response:
+            logger.warning(response['error'])
+
+
+    def _update_devices_values(self, clients=None):
+        ''' Get updated values from the devices. If no clients are given
+            all the clients that are due an update are polled. '''
+
+        if clients is None:
+            clients = self._get_due_clients()
+
+        self._age_devices()
+        results = self._poll_clients(clients)
+        self._apply_poll_results(clients, results)
+
+
+    def _apply_poll_results(self, clients, results):
+        ''' Apply the results of _poll_clients. The results are returned in
+            the same order as the clients so that the values are always
+            applied in a deterministic order. Clients that were removed or
+            updated while they were being polled are skipped. '''
+
+        for client, (values_json, error) in zip(clients, results):
+            if self.clients.get(client.alias) is client:
+                self._apply_client_values(client, values_json, error)
+
+
+    def _age_devices(self):
+        ''' Sets the previous value of the devices that changed since the
+            modules were last evaluated to their current value. The values
+            applied after this are compared to the current values. '''
+        for device in self._unaged_devices:
+            device.previous_value = device.value
+        self._unaged_devices = set()
+
+
+    def _poll_clients(self, clients):
+        ''' Fetch the latest values of the given clients. If more than one
+            poll worker is configured the clients are polled concurrently
+            so that a tick takes as long as the slowest client rather than
+            the sum of all the clients. '''
+
+        pool = self._get_poll_pool()
+        if pool is None or len(clients) <= 1:
+            return [ self._fetch_client_values(client) for client in clients ]
+
+        return list(pool.map(self._fetch_client_values, clients))
+
 
+    def _get_poll_pool(self):
+        ''' Returns the worker pool used to poll clients or None if the
+            clients are polled one after the other. The pool is resized
+            whenever the poll_workers config option changes. '''
+
+        workers = int(self.config.get('poll_workers') or 1)
+        if workers <= 1:
+            return None
+
+        if workers != self._poll_pool_size:
+            if self._poll_pool:
+                self._poll_pool.shutdown(wait=False)
+            self._poll_pool = ThreadPoolExecutor(max_workers=workers)
+            self._poll_pool_size = workers
+
+        return self._poll_pool
+
+
+    def _fetch_client_values(self, client):
+        ''' Performs the network request for the client values. This
+            method only updates the poll statistics of the client so that
+            it can be called from any thread. Returns a (values_json, error)
+            tuple where error is None if the request succeeded. '''
+
+        values_url = client.url + '/devices_value'
+        client.poll_started = time.monotonic()
+
+        # Only ask for the devices that changed since the last poll
+        params = None
+        if client.seq is not None:
+            params = { 'since': client.seq, 'epoch': client.epoch }
+
+        start_time = time.perf_counter()
+        try:
+            values = self._client_request(client, client.session.get, values_url, params=params)
+        except requests.exceptions.Timeout:
+            client.poll_timeouts += 1
+            return None, 'Timed out accessing client {}'.format(client.url)
+        except:
+            client.poll_errors += 1
+            return None, 'Unable to access client {}'.format(client.url)
+        finally:
+            client.poll_stats.add(time.perf_counter() - start_time)
+
+        try:
+            return values.json(), None
+        except:
+            client.poll_errors += 1
+            return None, 'Invalid json formatting for client {}'.format(client.url)
+
+
+    def _client_request(self, client, request, url, **kwargs):
+        ''' Makes a request to a client with a timeout derived from the
+            latency of its previous responses and updates the latency
+            estimate with the new response '''
+        start_time = time.perf_counter()
+        try:
+            r = request(url, timeout=self._get_client_timeout(client), **kwargs)
+        except requests.exceptions.Timeout:
+            client.latency.on_timeout()
+            raise
+        client.latency.add(time.perf_counter() - start_time)
+        return r
+
+
+    def _get_client_timeout(self, client):
+        ''' Fast clients time out quickly while slow clients get the time
+            they usually need, within the configured bounds. Probes of
+            clients that keep failing give up quickly. '''
+        timeout = client.latency.timeout(float(self.config.get('client_min_timeout') or 0.2),
+                                         float(self.config.get('client_max_timeout') or 5))
+        if client.breaker.is_open():
+            timeout = min(timeout, float(self.config.get('client_probe_timeout') or 0.5))
+        return timeout
+
+
+    def _apply_client_values(self, client, values_json, error):
+        ''' Update the client and its devices with the result of a poll '''
+
+        # The next poll is scheduled relative to when this one completed
+        client.last_polled = time.monotonic()
+        self._scheduler.reschedule(client.alias, client.last_polled)
+
+        client.connected = values_json is not None
+        previous_error = client.error
+
+        if client.connected:
+            if client.breaker.record_success():
+                logger.info('Client {} is reachable again'.format(client.url))
+        elif client.breaker.record_failure(int(self.config.get('client_failure_threshold') or 3),
+                                           float(self.config.get('client_max_backoff') or 60)):
+            logger.warning('Client {} failed {} times in a row, only probing it every {}s from now on'.format(
+                client.url, client.breaker.failures, client.breaker.backoff))
+
+        if not error:
             error = self._check_values_json_formatting(client.url, values_json)
-            if error:
-                client.on_error(error)
-            else:
-                client.on_no_error()
-                for device_json in values_json['devices']:
-                    self._update_device_value(client.alias, device_json)
+
+        if not error:
+            client.on_no_error()
+            updated, error = self._ingest_client_values(client, values_json['devices'])
+
+        if error:
+            # Get all the values again once the client is back
+            client.seq = None
+            client.on_error(error)
+        else:
+            # Write any outputs that couldn't be written while the client
+            # was unreachable
+            self._output_writer.resume(client)
+
+            if values_json.get('delta'):
+                # The devices left out of a delta haven't changed
+                for name, device in client.ingest_plan.items():
+                    if not name in updated:
+                        device.previous_value = device.value
+
+            # Clients that don't track changes don't report a sequence
+            client.seq = values_json.get('seq')
+            client.epoch = values_json.get('epoch')
+
+        if client.error != previous_error:
+            for name in client.devices:
+                self._on_device_error_changed(name)
 
 
     def _check_values_json_formatting(self, url, values_json):
-        ''' Check that the request body is correctly formatted '''
+        ''' Check that the request body is correctly formatted and that
+            every device has a name. Whether the devices have a value or
+            an error is checked as they are ingested. '''
+
+        if not isinstance(values_json, dict):
+            return 'Error for client {}: response is not a json object'.format(url)
 
         if 'error' in values_json:
             return 'Error for client {}: {}'.format(url, values_json['error'])
@@ -333,58 +1065,125 @@ class SwitchboardEngine(object):
         if not 'devices' in values_json:
             return 'Error for client {}: no "devices" field'.format(url)
 
+        if not isinstance(values_json['devices'], list):
+            return 'Error for client {}: "devices" field is not a list'.format(url)
+
         for device_json in values_json['devices']:
-            if not 'name' in device_json:
+            if not isinstance(device_json, dict):
+                return 'Error for client {}: found badly formatted device {}'.format(url, device_json)
+
+            name = device_json.get('name')
+            if name is None:
                 return 'Error for client {}: found device with no name'.format(url)
 
+            if not isinstance(name, str):
+                return 'Error for client {}: found device with invalid name {}'.format(url, name)
+
+
+    def _ingest_client_values(self, client, devices_json):
+        ''' Check and apply the json encoded device values of a client in
+            a single pass. The devices must have passed
+            _check_values_json_formatting. They are looked up in the
+            client's ingest plan by their local name. Devices the engine
+            doesn't know about are ignored. Returns a (names, error) tuple
+            with the local names of the devices in the response and an
+            error if a device has neither a value nor an error, in which
+            case the devices after it are not applied. '''
+
+        plan = client.ingest_plan
+        updated = set()
+        for device_json in devices_json:
+            name = device_json['name']
             if not 'value' in device_json and not 'error' in device_json:
-                return 'Error for client {}: device {} has no value or error field'.format(
-                        url, device_json['name'])
+                return updated, 'Error for client {}: device {} has no value or error field'.format(
+                        client.url, name)
+
+            updated.add(name)
+            device = plan.get(name)
+            if device:
+                self._update_device_value(device, device_json)
+
+        return updated, None
 
 
-    def _update_device_value(self, client_alias, device_json):
+    def _update_device_value(self, device, device_json):
         ''' Given a correctly formatted json encoded device value,
             update the local device object '''
 
-        global_dev_name = '{}.{}'.format(client_alias, device_json['name'])
-        device = self.devices[global_dev_name]
-
         if 'error' in device_json:
             if not device.error:
                 logger.warning('Device {} has reported an error: {}'.format(
-                    global_dev_name, device_json['error']))
+                    device.name, device_json['error']))
+            if device.error != device_json['error']:
+                self._on_device_error_changed(device.name)
             device.error = device_json['error']
 
-        elif 'value' in device_json:
+        else:
             if device.error:
                 logger.warning('Device {} no longer reporting error'.format(
-                    global_dev_name))
+                    device.name))
                 device.error = None
+                self._on_device_error_changed(device.name)
+            if device.value != device_json['value']:
+                self._on_device_value_changed(device.name)
+                self._unaged_devices.add(device)
             device.update_value(device_json['value'])
 
 
 
 class _ClientInfo:
-    def __init__(self, url, alias, devices, poll_period):
+    def __init__(self, url, alias, devices, poll_period, session=None):
         self.url = url
         self.alias = alias
         self.connected = False
         self.error = None
         self.devices = devices
         self.poll_period = poll_period  # Poll every iteration if None
-        self.last_polled = 0.0
-        logger = logging.getLogger(__name__)
 
-    def do_update(self):
-        ''' Determines if we should update this client or not '''
-        if self.poll_period == None:
-            return True
+        # Map of local device name (as reported by the client) -> device
+        # so that polled values are applied without building global names.
+        # Built by compile_ingest_plan().
+        self.ingest_plan = {}
+        self.last_polled = 0.0  # Monotonic time at which the last poll completed
+        self.poll_started = 0.0  # Monotonic time at which the last poll started
+
+        # Change sequence number and epoch reported by the client's last
+        # poll. Used to only request the devices that changed since.
+        self.seq = None
+        self.epoch = None
+
+        # Keep-alive HTTP session used for all the requests to this client
+        self.session = session if session else create_http_session(1)
+
+        # Output values waiting to be written (local device name -> value)
+        self.pending_writes = {}
 
-        if time.time() - self.last_polled > float(self.poll_period):
-            self.last_polled = time.time()
-            return True
+        # Cleared if the client doesn't support the /devices_set endpoint
+        self.batch_writes = True
+
+        # Poll latency and failure counts
+        self.poll_stats = TimingStats()
+        self.poll_errors = 0
+        self.poll_timeouts = 0
+
+        # Stops the client from being polled at every tick while it is down
+        self.breaker = CircuitBreaker()
+
+        # Estimates the latency of the client to derive its timeouts from
+        self.latency = LatencyEstimator()
+        logger = logging.getLogger(__name__)
 
-        return False
+    def compile_ingest_plan(self):
+        prefix_length = len(self.alias) + 1
+        self.ingest_plan = { sys.intern(name[prefix_length:]): device for name, device in self.devices.items() }
+
+    def get_poll_stats(self):
+        return {
+            'latency': self.poll_stats.summary(),
+            'errors': self.poll_errors,
+            'timeouts': self.poll_timeouts,
+            'breaker': self.breaker.state
+        }
 
     def on_error(self, msg):
         ''' Sets the error state of the client and all its associated devices '''
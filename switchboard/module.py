@@ -1,25 +1,74 @@
 
+import time
 import inspect
 import logging
 from functools import wraps
 
 from switchboard.device import SignalDevice, get_device_suffix
+from switchboard.module_process import ModuleProcess
+from switchboard.stats import HistogramStats
 from switchboard.utils import determine_if_class_method
 
 logger = logging.getLogger(__name__)
 
 
+# When a module is evaluated:
+# * always: at every tick
+# * on_change: only when the value of one of its inputs or the error state
+#       of one of its inputs or outputs has changed
+MODULE_TRIGGERS = [ 'always', 'on_change' ]
+
+# Where a module is evaluated:
+# * thread: in the engine, or in one of its module workers
+# * process: in a dedicated worker process that is kept alive between ticks
+MODULE_EXECUTORS = [ 'thread', 'process' ]
+
+
 class ModuleError(Exception):
     pass
 
 
 class SwitchboardModule:
-    def __init__(self, inputs=[], outputs={}, static_variables={}, evaluate_if_error=False):
+    def __init__(self, inputs=[], outputs={}, static_variables={}, evaluate_if_error=False,
+                 trigger='always', executor='thread', time_budget=None, max_overruns=None):
+        if not trigger in MODULE_TRIGGERS:
+            raise ModuleError('Invalid module trigger "{}", must be one of {}'.format(trigger, MODULE_TRIGGERS))
+
+        if not executor in MODULE_EXECUTORS:
+            raise ModuleError('Invalid module executor "{}", must be one of {}'.format(executor, MODULE_EXECUTORS))
+
         # Input and output devices/signals this module uses
         self.inputs = inputs
         self.outputs = outputs
         self.static_variables = static_variables
         self.evaluate_if_error = evaluate_if_error
+        self.trigger = trigger
+        self.executor = executor
+
+        # Worker process the module is evaluated in if the executor is 'process'
+        self._process = None
+
+        # Time in seconds an evaluation of the module may take and the
+        # number of consecutive evaluations that may exceed it before the
+        # module is disabled. The engine's defaults are used if they
+        # aren't set. 0 means no limit.
+        self.time_budget = time_budget
+        self.max_overruns = max_overruns
+        self._default_time_budget = 0.0
+        self._default_max_overruns = 0
+
+        # Duration of the last evaluation and time budget overrun counts
+        self.last_duration = 0.0
+        self.overruns = 0
+        self._consecutive_overruns = 0
+
+        # Error set when the module is disabled for overrunning its budget
+        self._budget_error = None
+
+        # Runtime of every evaluation and the number of evaluations
+        # skipped due to a device error
+        self.runtime_stats = HistogramStats()
+        self.skipped = 0
 
         # Tuple of devices that will act as arguments to the module
         self._arguments = ()
@@ -42,11 +91,11 @@ class SwitchboardModule:
         self.is_class_method = False
 
 
-    def create_argument_list(self, device_list):
+    def create_argument_list(self, device_list, create_signal=SignalDevice):
         ''' Associates the module inputs and outputs (as given by the
             decorator) with the actual device instances. If an internal
             switchboard signal is defined it will be created on the spot
-            and added to device_list
+            with create_signal and added to device_list
 
             Does not change any state if an error occurs '''
 
@@ -58,7 +107,7 @@ class SwitchboardModule:
         self._arguments = ()
 
         for input in self.inputs:
-            device = self._get_signal(input, device_list)
+            device = self._get_signal(input, device_list, create_signal)
 
             if not device.is_input:
                 on_error('Can not use {} as an input to module {} as the '
@@ -67,7 +116,7 @@ class SwitchboardModule:
             self._arguments += (device.input_signal, )
 
         for output in self.outputs:
-            device = self._get_signal(output, device_list)
+            device = self._get_signal(output, device_list, create_signal)
 
             if not device.is_output:
                 on_error('Can not use {} as an output to module {} as the '
@@ -93,11 +142,11 @@ class SwitchboardModule:
 
         # Only assign driving modules once we're sure there are no errors
         for output in self.outputs.keys():
-            output_signal = self._get_signal(output, device_list).output_signal
+            output_signal = self._get_signal(output, device_list, create_signal).output_signal
             output_signal.driving_module = self.name
 
 
-    def _get_signal(self, signal_name, device_list):
+    def _get_signal(self, signal_name, device_list, create_signal):
         ''' Gets the instance of the device associated with the signal.
             If the signal is internal to the design a SignalDevice is
             automatically created. '''
@@ -105,8 +154,8 @@ class SwitchboardModule:
         if not signal_name in device_list:
             if get_device_suffix(signal_name) == 's':
                 logger.info('Creating signal {}'.format(signal_name))
-                signal = SignalDevice(signal_name)
-                device_list.append(signal)
+                signal = create_signal(signal_name)
+                device_list[signal_name] = signal
                 return signal
             else:
                 self.error = 'Unkown io device {}'.format(signal_name)
@@ -146,6 +195,64 @@ class SwitchboardModule:
         return False
 
 
+    def set_budget_defaults(self, time_budget, max_overruns):
+        ''' Sets the time budget and max overruns used if the module
+            doesn't specify its own '''
+        self._default_time_budget = time_budget
+        self._default_max_overruns = max_overruns
+
+
+    def get_time_budget(self):
+        return self.time_budget if self.time_budget is not None else self._default_time_budget
+
+
+    def check_time_budget(self):
+        ''' Counts the evaluations that took longer than the time budget
+            and disables the module if it keeps overrunning '''
+        budget = self.get_time_budget()
+        if not budget or self.last_duration <= budget:
+            self._consecutive_overruns = 0
+            return
+
+        self.overruns += 1
+        self._consecutive_overruns += 1
+        logger.warning('Module {} took {:.3f}s which exceeds its time budget of {:.3f}s'.format(
+            self.name, self.last_duration, budget))
+
+        max_overruns = self.max_overruns if self.max_overruns is not None else self._default_max_overruns
+        if max_overruns and self._consecutive_overruns >= max_overruns:
+            self.enabled = False
+            self.error = 'Exceeded its time budget of {}s {} times in a row'.format(
+                budget, self._consecutive_overruns)
+            self._budget_error = self.error
+            logger.error('Disabling module {}: {}'.format(self.name, self.error))
+
+
+    def clear_time_budget_error(self):
+        ''' Called when the module is enabled again after being disabled
+            for overrunning its time budget '''
+        self._consecutive_overruns = 0
+        if self._budget_error and self.error == self._budget_error:
+            self.error = None
+        self._budget_error = None
+
+
+    def get_stats(self):
+        return {
+            'calls': self.runtime_stats.count,
+            'skipped': self.skipped,
+            'overruns': self.overruns,
+            'crashes': self._process.crashes if self._process else 0,
+            'runtime': self.runtime_stats.summary()
+        }
+
+
+    def shutdown(self):
+        ''' Stops the worker process of the module, if it has one '''
+        if self._process:
+            self._process.shutdown()
+
+
     def set_output_error_values(self):
         ''' Sets all the outputs to their given error value '''
         for error_callback in self._call_if_error:
@@ -161,9 +268,26 @@ class SwitchboardModule:
 
             if self.enabled:
                 if self.check_module_io_error():
+                    self.skipped += 1
                     return
 
-                f(*(args + self._arguments))
+                # Spawn the worker outside of the time budget so that its
+                # startup doesn't count as an overrun
+                if self._process and not self._process.start():
+                    return
+
+                start_time = time.perf_counter()
+                try:
+                    if self._process:
+                        num_inputs = len(self.inputs)
+                        self._process.evaluate(self._arguments[:num_inputs], self._arguments[num_inputs:],
+                                               self.get_time_budget() or None)
+                    else:
+                        f(*(args + self._arguments))
+                finally:
+                    self.last_duration = time.perf_counter() - start_time
+                    self.runtime_stats.add(self.last_duration)
+                    self.check_time_budget()
 
         self.is_class_method = determine_if_class_method(inspect.stack())
 
@@ -175,6 +299,12 @@ class SwitchboardModule:
         for variable, init_value in self.static_variables.items():
             setattr(wrapped_func, variable, init_value)
 
+        if self.executor == 'process':
+            if self.is_class_method:
+                raise ModuleError('Switchboard modules that are class methods'
+                                  ' can not run in a worker process')
+            self._process = ModuleProcess('{}.{}'.format(f.__module__, f.__name__))
+
         wrapped_func.module_class = self
         self.name = f.__name__
         return wrapped_func
@@ -0,0 +1,213 @@
+
+import heapq
+
+from switchboard.device import get_device_suffix
+
+
+class ModuleGraph(object):
+    ''' Dataflow graph of the Switchboard modules. A module depends on
+        another module if it uses an internal signal (.s) driven by that
+        module as an input. Only internal signals create dependencies as
+        they are the only devices whose new value can be read within the
+        same tick; values written to client devices are only read back
+        at the next poll.
+
+        The modules are ordered so that every module is evaluated after
+        the modules it depends on, so a chain of signals settles within
+        a single tick. Modules that depend on each other in a cycle can't
+        be ordered among themselves and are evaluated in the order they
+        were added, still after the modules they depend on and before the
+        modules that depend on them.
+
+        Modules that share no devices, directly or through other modules,
+        are independent of each other and are grouped into separate
+        components that can be evaluated concurrently. '''
+
+    def __init__(self, modules=[]):
+        ''' modules is an ordered list of (name, module_class) tuples '''
+        self._names = [ name for name, _ in modules ]
+
+        # Map of module name -> names of the modules it depends on and
+        # of the modules that depend on it
+        self.dependencies = { name: set() for name in self._names }
+        self.dependents = { name: set() for name in self._names }
+
+        drivers = {}
+        for name, module_class in modules:
+            for output in module_class.outputs:
+                if get_device_suffix(output) == 's':
+                    drivers.setdefault(output, set()).add(name)
+
+        for name, module_class in modules:
+            for input in module_class.inputs:
+                for driver in drivers.get(input, ()):
+                    self.dependencies[name].add(driver)
+                    self.dependents[driver].add(name)
+
+        self.order, unordered = self._sort()
+        strong_components = self._find_strong_components(unordered)
+        self.cycles = [ component for component in strong_components
+                        if len(component) > 1 or component[0] in self.dependencies[component[0]] ]
+        self.order += self._sort_strong_components(strong_components)
+        self.critical_path = self._find_critical_path(set(name for cycle in self.cycles for name in cycle))
+        self.components = self._find_components(modules)
+
+    def critical_path_length(self):
+        ''' Number of modules in the longest chain of dependent modules '''
+        return len(self.critical_path)
+
+    def _sort(self):
+        ''' Kahn's algorithm. Ties are broken by the order in which the
+            modules were added so that the order is deterministic.
+            Returns the ordered modules and the modules that couldn't be
+            ordered due to cycles. '''
+        position = { name: i for i, name in enumerate(self._names) }
+        in_degree = { name: len(deps) for name, deps in self.dependencies.items() }
+
+        ready = [ (position[name], name) for name in self._names if in_degree[name] == 0 ]
+        heapq.heapify(ready)
+
+        order = []
+        while ready:
+            _, name = heapq.heappop(ready)
+            order.append(name)
+            for dependent in self.dependents[name]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    heapq.heappush(ready, (position[dependent], dependent))
+
+        ordered = set(order)
+        unordered = [ name for name in self._names if not name in ordered ]
+        return order, unordered
+
+    def _sort_strong_components(self, components):
+        ''' Kahn's algorithm over the graph of the strongly connected
+            components, so that the modules downstream of a cycle are
+            evaluated after it. Ties are broken by the order in which the
+            first module of each component was added. Returns the modules
+            of the components in evaluation order. '''
+        position = { name: i for i, name in enumerate(self._names) }
+        component_of = { name: i for i, component in enumerate(components) for name in component }
+
+        dependents = [ set() for _ in components ]
+        in_degree = [ 0 ] * len(components)
+        for i, component in enumerate(components):
+            for name in component:
+                for dependent in self.dependents[name]:
+                    j = component_of.get(dependent)
+                    if j is not None and j != i and not j in dependents[i]:
+                        dependents[i].add(j)
+                        in_degree[j] += 1
+
+        ready = [ (position[component[0]], i) for i, component in enumerate(components) if in_degree[i] == 0 ]
+        heapq.heapify(ready)
+
+        order = []
+        while ready:
+            _, i = heapq.heappop(ready)
+            order += components[i]
+            for j in dependents[i]:
+                in_degree[j] -= 1
+                if in_degree[j] == 0:
+                    heapq.heappush(ready, (position[components[j][0]], j))
+
+        return order
+
+    def _find_strong_components(self, names):
+        ''' Returns the strongly connected components of the given modules,
+            each as a list of module names in the order they were added '''
+        names = set(names)
+        index = {}
+        low_link = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        for root in self._names:
+            if not root in names or root in index:
+                continue
+
+            # Iterative version of Tarjan's algorithm
+            work = [ (root, iter(sorted(self.dependents[root] & names))) ]
+            index[root] = low_link[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                name, dependents = work[-1]
+                for dependent in dependents:
+                    if not dependent in index:
+                        index[dependent] = low_link[dependent] = len(index)
+                        stack.append(dependent)
+                        on_stack.add(dependent)
+                        work.append((dependent, iter(sorted(self.dependents[dependent] & names))))
+                        break
+                    elif dependent in on_stack:
+                        low_link[name] = min(low_link[name], index[dependent])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low_link[parent] = min(low_link[parent], low_link[name])
+
+                    if low_link[name] == index[name]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.remove(member)
+                            component.append(member)
+                            if member == name:
+                                break
+
+                        components.append(sorted(component, key=self._names.index))
+
+        return components
+
+    def _find_components(self, modules):
+        ''' Groups the modules that share devices into components. The
+            modules of each component are in evaluation order. '''
+        parent = { name: name for name in self._names }
+
+        def find(name):
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        users = {}
+        for name, module_class in modules:
+            for device in list(module_class.inputs) + list(module_class.outputs):
+                if device in users:
+                    parent[find(name)] = find(users[device])
+                else:
+                    users[device] = name
+
+        components = {}
+        for name in self.order:
+            components.setdefault(find(name), []).append(name)
+        return list(components.values())
+
+    def _find_critical_path(self, excluded):
+        ''' Longest chain of dependent modules, ignoring the modules that
+            are part of a cycle '''
+        length = {}
+        previous = {}
+        for name in self.order:
+            if name in excluded:
+                continue
+            length[name] = 1
+            previous[name] = None
+            for dependency in self.dependencies[name]:
+                if dependency in length and length[dependency] + 1 > length[name]:
+                    length[name] = length[dependency] + 1
+                    previous[name] = dependency
+
+        if not length:
+            return []
+
+        name = max(self.order, key=lambda n: length.get(n, 0))
+        path = []
+        while name:
+            path.append(name)
+            name = previous[name]
+        return list(reversed(path))
@@ -0,0 +1,160 @@
+
+import importlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+
+# Modules loaded by this worker process (module path -> module function)
+_worker_modules = {}
+
+
+class _WorkerInputSignal(object):
+    ''' Worker process copy of an InputSignal '''
+    def __init__(self, name, value, changed, error):
+        self._name = name
+        self._value = value
+        self._changed = changed
+        self._error = error
+
+    def get_value(self):
+        return self._value
+
+    def has_changed(self):
+        return self._changed
+
+    def get_error(self):
+        return self._error
+
+    def get_name(self):
+        return self._name
+
+
+class _WorkerOutputSignal(object):
+    ''' Worker process stand-in for an OutputSignal. The values set by
+        the module are sent back to the engine. '''
+    def __init__(self, name, error, index, values_set):
+        self._name = name
+        self._error = error
+        self._index = index
+        self._values_set = values_set
+
+    def set_value(self, value):
+        self._values_set.append((self._index, value))
+
+    def get_error(self):
+        return self._error
+
+    def get_name(self):
+        return self._name
+
+
+def _load_in_worker(module_path):
+    ''' Runs in the worker process. Loads the module once so that its
+        static variables keep their state from one tick to the next. '''
+    if not module_path in _worker_modules:
+        pymodule, attribute = module_path.rsplit('.', 1)
+        _worker_modules[module_path] = getattr(importlib.import_module(pymodule), attribute)
+    return _worker_modules[module_path]
+
+
+def _evaluate_in_worker(module_path, inputs, outputs):
+    ''' Runs in the worker process. Evaluates the module with the given
+        input values. Returns a list of (output index, value) tuples for
+        every value the module set. '''
+    module = _load_in_worker(module_path)
+
+    values_set = []
+    arguments = [ _WorkerInputSignal(*i) for i in inputs ]
+    arguments += [ _WorkerOutputSignal(name, error, index, values_set)
+                   for index, (name, error) in enumerate(outputs) ]
+
+    # Call the undecorated function, the engine has already checked for
+    # device errors
+    module.__wrapped__(*arguments)
+    return values_set
+
+
+class ModuleProcess(object):
+    ''' Evaluates a module in a dedicated worker process so that CPU heavy
+        modules don't compete with the engine for the GIL. The worker is
+        kept alive from one tick to the next. Only the values of the
+        module's devices are sent to the worker and only the values the
+        module sets are sent back. '''
+
+    def __init__(self, module_path):
+        # Import path of the module function, e.g. 'package.module.func'
+        self.module_path = module_path
+        self._pool = None
+
+        # Number of evaluations lost because the worker process died
+        self.crashes = 0
+
+    def start(self):
+        ''' Spawns the worker and loads the module in it if it isn't
+            running yet. This isn't subject to the evaluation timeout as
+            spawning a process and importing the module can take much
+            longer than an evaluation. Returns False if the worker died
+            while starting. '''
+        if self._pool:
+            return True
+
+        # Spawn rather than fork the worker as the engine has threads
+        self._pool = ProcessPoolExecutor(max_workers=1,
+                mp_context=multiprocessing.get_context('spawn'))
+
+        try:
+            self._pool.submit(_load_in_worker, self.module_path).result()
+        except BrokenProcessPool:
+            logger.error('Worker process of module {} died while starting'.format(self.module_path))
+            self.crashes += 1
+            self.shutdown()
+            return False
+        except Exception:
+            self.shutdown()
+            raise
+
+        return True
+
+    def evaluate(self, input_signals, output_signals, timeout=None):
+        ''' Evaluate the module in the worker with the current values of
+            the input signals and apply the values it set to the output
+            signals. If the module takes longer than timeout seconds or
+            the worker dies none of the values are applied, and a new
+            worker is spawned for the next evaluation. '''
+        inputs = [ (s.get_name(), s.get_value(), s.has_changed(), s.get_error())
+                   for s in input_signals ]
+        outputs = [ (s.get_name(), s.get_error()) for s in output_signals ]
+
+        if not self.start():
+            return
+
+        try:
+            values_set = self._pool.submit(_evaluate_in_worker, self.module_path, inputs, outputs).result(timeout)
+        except TimeoutError:
+            logger.error('Module {} timed out after {}s, killing its worker process'.format(
+                self.module_path, timeout))
+            self._kill()
+            return
+        except BrokenProcessPool:
+            logger.error('Worker process of module {} died, restarting it'.format(self.module_path))
+            self.crashes += 1
+            self.shutdown()
+            return
+
+        for index, value in values_set:
+            output_signals[index].set_value(value)
+
+    def _kill(self):
+        # The executor can't stop a busy worker so terminate the process
+        for process in list(getattr(self._pool, '_processes', {}).values()):
+            process.terminate()
+        self.shutdown()
+
+    def shutdown(self):
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
@@ -0,0 +1,196 @@
+
+import time
+import logging
+from threading import Thread, Lock, Condition
+from collections import deque
+
+from switchboard.stats import TimingStats
+
+
+logger = logging.getLogger(__name__)
+
+
+class OutputWriter(object):
+    ''' Writes output values to the clients from background worker
+        threads so that module evaluation never waits on the network.
+
+        Every client has at most one set of pending values, keyed by
+        device name. Writing a device that already has a pending value
+        replaces that value, so the queue of a client can never grow
+        beyond the number of outputs it has and only the latest value
+        of each output is written. If a write fails the values are kept
+        and written again once the client is resumed. '''
+
+    def __init__(self, write_func, workers=1):
+        # Function called as write_func(client, { name: value }) to write
+        # the values of a client. Returns False if the write failed.
+        self._write_func = write_func
+
+        self._lock = Lock()
+
+        # Notified when there are values to write
+        self._ready = Condition(self._lock)
+
+        # Notified whenever a write completes
+        self._written = Condition(self._lock)
+
+        # Map of client alias -> (client, { device name: value })
+        self._pending = {}
+
+        # Aliases of the clients with pending values that can be written
+        self._queue = deque()
+
+        # Aliases of the clients that are currently being written to
+        self._in_progress = set()
+
+        # Aliases of the clients whose last write failed. Their values
+        # are held back until the client is resumed.
+        self._stalled = set()
+
+        # Clients that were removed while being written to. The values of
+        # their write in progress are dropped if it fails.
+        self._removed = set()
+
+        self._target_workers = workers
+        self._workers = []
+
+        # Counters
+        self.write_stats = TimingStats()
+        self.superseded = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def set_workers(self, workers):
+        ''' Sets the number of worker threads. Workers are started when
+            values are submitted. The number of workers never shrinks. '''
+        with self._lock:
+            self._target_workers = max(1, workers)
+
+    def submit(self, writes):
+        ''' Queue the output values of a list of (client, { name: value })
+            tuples to be written in the background '''
+        with self._lock:
+            for client, client_writes in writes:
+                self._put(client, client_writes)
+            self._start_workers()
+
+    def _put(self, client, client_writes):
+        alias = client.alias
+        if alias in self._pending and self._pending[alias][0] is client:
+            pending = self._pending[alias][1]
+            for name, value in client_writes.items():
+                if name in pending:
+                    self.superseded += 1
+                pending[name] = value
+        else:
+            self._pending[alias] = (client, dict(client_writes))
+
+        self._enqueue(alias)
+
+    def _enqueue(self, alias):
+        if alias in self._queue or alias in self._in_progress or alias in self._stalled:
+            return
+        self._queue.append(alias)
+        self._ready.notify()
+
+    def resume(self, client):
+        ''' Called when a client is reachable again. Writes the latest
+            values that could not be written to the client. '''
+        with self._lock:
+            if client.alias in self._stalled:
+                self._stalled.remove(client.alias)
+                if client.alias in self._pending:
+                    logger.info('Writing pending outputs to client {}'.format(client.url))
+                    self._enqueue(client.alias)
+
+    def remove(self, client):
+        ''' Drop all the pending values of a client '''
+        with self._lock:
+            if client.alias in self._pending:
+                self.dropped += len(self._pending[client.alias][1])
+                del self._pending[client.alias]
+            if client.alias in self._queue:
+                self._queue.remove(client.alias)
+            self._stalled.discard(client.alias)
+            if client.alias in self._in_progress:
+                self._removed.add(client)
+
+    def queue_depth(self):
+        ''' Number of output values waiting to be written '''
+        with self._lock:
+            return sum(len(writes) for _, writes in self._pending.values())
+
+    def flush(self, timeout=None):
+        ''' Wait until all the values that can be written have been
+            written. Returns False if the timeout expired first. '''
+        end_time = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._queue or self._in_progress:
+                remaining = None if end_time is None else end_time - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._written.wait(remaining)
+        return True
+
+    def get_stats(self):
+        return {
+            'queue_depth': self.queue_depth(),
+            'stalled_clients': len(self._stalled),
+            'superseded': self.superseded,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'write': self.write_stats.summary()
+        }
+
+    def _start_workers(self):
+        while len(self._workers) < self._target_workers:
+            thread = Thread(target=self._worker)
+            thread.daemon = True
+            self._workers.append(thread)
+            thread.start()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._ready.wait()
+
+                alias = self._queue.popleft()
+                client, writes = self._pending.pop(alias)
+                self._in_progress.add(alias)
+
+            start_time = time.perf_counter()
+            try:
+                written = self._write_func(client, writes)
+            except Exception as e:
+                logger.error('Exception "{}" when writing outputs of client {}'.format(e, client.url))
+                written = False
+            duration = time.perf_counter() - start_time
+
+            with self._lock:
+                self._in_progress.discard(alias)
+                self.write_stats.add(duration)
+
+                newer = self._pending.get(alias)
+                if client in self._removed:
+                    # Only values submitted for a new client with the same
+                    # alias are still of interest
+                    self._removed.discard(client)
+                    if not written:
+                        self.failed += 1
+                        self.dropped += len(writes)
+                    if newer:
+                        self._enqueue(alias)
+                elif not written and (newer is None or newer[0] is client):
+                    # Keep the values that haven't been superseded so that
+                    # they can be written once the client is back
+                    self.failed += 1
+                    if newer:
+                        writes.update(newer[1])
+                    self._pending[alias] = (client, writes)
+                    self._stalled.add(alias)
+                elif newer:
+                    # Values were submitted while we were writing
+                    self._enqueue(alias)
+
+                self._written.notify_all()
@@ -0,0 +1,175 @@
+
+import time
+import heapq
+import itertools
+
+from switchboard.stats import TimingStats
+
+
+# Policies for when a tick starts so late that one or more ticks were missed:
+# * skip: drop the missed ticks and carry on with the next tick in phase
+# * catch_up: run the missed ticks back to back until back on schedule
+OVERRUN_POLICIES = [ 'skip', 'catch_up' ]
+
+
+class PollScheduler(object):
+    ''' Keeps track of when each client with its own poll period is next
+        due to be polled. The deadlines are kept in a min-heap so that the
+        engine can sleep exactly until the next client is due instead of
+        checking every client at every tick. Periods may be shorter than
+        the Switchboard poll period.
+
+        Times are taken from the monotonic clock so that the schedule is
+        not affected by wall-clock jumps. '''
+
+    # Indices of the fields of a heap entry
+    _DUE, _SEQ, _ALIAS, _PERIOD = range(4)
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+
+        # Heap of [due time, insertion count, alias, period] entries. The
+        # insertion count keeps the ordering of equal due times stable.
+        self._heap = []
+
+        # Map of alias -> entry for every scheduled client
+        self._entries = {}
+
+        # Entries that have been handed out by pop_due and are waiting to
+        # be rescheduled once the poll completes
+        self._in_flight = set()
+
+        self._counter = itertools.count()
+
+    def __contains__(self, alias):
+        return alias in self._entries
+
+    def add(self, alias, period, due=None):
+        ''' Schedule the client with the given alias to be polled every
+            period seconds. The first poll happens at the given due time,
+            or one period from now if due is not given. '''
+        self.remove(alias)
+
+        if due is None:
+            due = self._clock() + period
+
+        entry = [ due, next(self._counter), alias, period ]
+        self._entries[alias] = entry
+        heapq.heappush(self._heap, entry)
+
+    def remove(self, alias):
+        ''' Stop polling the client with the given alias. The entry is
+            lazily removed from the heap. '''
+        entry = self._entries.pop(alias, None)
+        if entry:
+            entry[self._ALIAS] = None
+        self._in_flight.discard(alias)
+
+    def next_due(self):
+        ''' Returns the time at which the next client is due or None if
+            no client is scheduled '''
+        self._discard_removed()
+        if not self._heap:
+            return None
+        return self._heap[0][self._DUE]
+
+    def pop_due(self, now=None):
+        ''' Returns the aliases of all the clients that are due, in order
+            of their due time. The clients stay scheduled but won't be
+            returned again until reschedule() is called for them. '''
+        if now is None:
+            now = self._clock()
+
+        due = []
+        self._discard_removed()
+        while self._heap and self._heap[0][self._DUE] <= now:
+            entry = heapq.heappop(self._heap)
+            alias = entry[self._ALIAS]
+            self._in_flight.add(alias)
+            due.append(alias)
+            self._discard_removed()
+
+        return due
+
+    def reschedule(self, alias, completed=None):
+        ''' Schedules the next poll of a client returned by pop_due once
+            its poll has completed. The next poll keeps the phase of the
+            schedule unless the poll overran the period, in which case
+            the next poll is a full period after the poll completed. '''
+        if not alias in self._in_flight:
+            return
+        self._in_flight.remove(alias)
+
+        if completed is None:
+            completed = self._clock()
+
+        entry = self._entries[alias]
+        period = entry[self._PERIOD]
+        due = entry[self._DUE] + period
+        if due <= completed:
+            due = completed + period
+
+        new_entry = [ due, next(self._counter), alias, period ]
+        self._entries[alias] = new_entry
+        heapq.heappush(self._heap, new_entry)
+
+    def _discard_removed(self):
+        while self._heap and self._heap[0][self._ALIAS] is None:
+            heapq.heappop(self._heap)
+
+
+class TickTimer(object):
+    ''' Deadline based timer for the Switchboard tick. Tick deadlines
+        are whole periods apart on the monotonic clock, so the tick phase
+        neither drifts with the time it takes to process a tick nor jumps
+        with the wall-clock. Records how late every tick starts (jitter)
+        and how often ticks are missed. '''
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+
+        # Monotonic time of the next tick. The first tick is immediate.
+        self.next_deadline = None
+
+        # Number of ticks that started after the following tick was due
+        self.overruns = 0
+
+        # Number of ticks dropped by the 'skip' overrun policy
+        self.skipped = 0
+
+        # How late the ticks started compared to their deadline
+        self.jitter_stats = TimingStats()
+
+    def time_until_tick(self):
+        ''' Time left until the next tick is due '''
+        if self.next_deadline is None:
+            return 0.0
+        return max(0.0, self.next_deadline - self._clock())
+
+    def is_due(self):
+        return self.next_deadline is None or self._clock() >= self.next_deadline
+
+    def tick(self, period, overrun_policy='skip'):
+        ''' Start the tick that is due and work out the next deadline '''
+        now = self._clock()
+        if self.next_deadline is None:
+            self.next_deadline = now
+
+        self.jitter_stats.add(now - self.next_deadline)
+
+        next_deadline = self.next_deadline + period
+        if next_deadline <= now:
+            self.overruns += 1
+            if overrun_policy == 'skip' and period > 0:
+                missed = int((now - self.next_deadline) // period)
+                self.skipped += missed
+                next_deadline = self.next_deadline + (missed + 1) * period
+
+        self.next_deadline = next_deadline
+
+    def get_stats(self):
+        return {
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'jitter': self.jitter_stats.summary()
+        }
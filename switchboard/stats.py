@@ -0,0 +1,279 @@
+
+import math
+import time
+from threading import Lock
+from collections import deque
+
+
+# Statistics that can be queried with the 'stats' command
+STATS_TARGETS = [ 'engine', 'graph', 'lock', 'modules', 'outputs', 'tick' ]
+
+
+class TimingStats(object):
+    ''' Records durations (in seconds) and keeps running totals as well as
+        a rolling window of the most recent samples to compute
+        percentiles from '''
+
+    def __init__(self, window=1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples = deque(maxlen=window)
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self._samples.append(duration)
+
+    def summary(self):
+        ''' Returns a dict with the count, mean, max and the p50, p95 and
+            p99 percentiles of the recorded durations '''
+        samples = sorted(list(self._samples))
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+            'p99': percentile(0.99)
+        }
+
+
+class HistogramStats(object):
+    ''' Records durations (in seconds) into logarithmic buckets. Recording
+        a duration takes constant time and the memory used is fixed, so it
+        is cheap enough to be left on for every module evaluation. The
+        percentiles are accurate to within one bucket (19%). '''
+
+    # Bucket i counts the durations up to MIN_DURATION * GROWTH ** i.
+    # The last bucket counts all the longer durations.
+    MIN_DURATION = 1e-6
+    GROWTH = 2 ** 0.25
+    NUM_BUCKETS = 112
+
+    _LOG_GROWTH = math.log(GROWTH)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._buckets = [ 0 ] * self.NUM_BUCKETS
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+        if duration <= self.MIN_DURATION:
+            bucket = 0
+        else:
+            bucket = min(self.NUM_BUCKETS - 1,
+                         int(math.ceil(math.log(duration / self.MIN_DURATION) / self._LOG_GROWTH)))
+        self._buckets[bucket] += 1
+
+    def _percentile(self, p):
+        ''' Upper bound of the bucket the percentile falls in, or the
+            longest duration if that is smaller '''
+        if not self.count:
+            return 0.0
+
+        rank = p * self.count
+        cumulative = 0
+        for bucket, count in enumerate(self._buckets):
+            cumulative += count
+            if cumulative > rank:
+                break
+        if bucket == self.NUM_BUCKETS - 1:
+            return self.max
+        return min(self.max, self.MIN_DURATION * self.GROWTH ** bucket)
+
+    def summary(self):
+        ''' Returns a dict with the count, total, mean, max and the p50,
+            p95 and p99 percentiles of the recorded durations '''
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self._percentile(0.50),
+            'p95': self._percentile(0.95),
+            'p99': self._percentile(0.99)
+        }
+
+
+class LatencyEstimator(object):
+    ''' Estimates the latency of a client the way TCP estimates round
+        trip times (RFC 6298). A smoothed latency and its mean deviation
+        are updated with every response and the timeout is the smoothed
+        latency plus four times the deviation. Every timeout doubles the
+        timeout until the next response. '''
+
+    ALPHA = 1.0 / 8
+    BETA = 1.0 / 4
+    K = 4
+
+    def __init__(self):
+        self.smoothed = None
+        self.deviation = None
+        self._backoff = 1
+
+    def add(self, latency):
+        ''' Updates the estimate with the latency of a response '''
+        if self.smoothed is None:
+            self.smoothed = latency
+            self.deviation = latency / 2
+        else:
+            self.deviation = (1 - self.BETA) * self.deviation + self.BETA * abs(self.smoothed - latency)
+            self.smoothed = (1 - self.ALPHA) * self.smoothed + self.ALPHA * latency
+        self._backoff = 1
+
+    def on_timeout(self):
+        self._backoff = min(self._backoff * 2, 64)
+
+    def timeout(self, min_timeout, max_timeout):
+        ''' The timeout to use for the next request, clamped to the given
+            bounds. The max timeout is used until there is an estimate. '''
+        if self.smoothed is None:
+            return max_timeout
+        timeout = (self.smoothed + self.K * self.deviation) * self._backoff
+        return min(max_timeout, max(min_timeout, timeout))
+
+
+class PhaseTimer(object):
+    ''' Times the consecutive phases of a loop. start() is called at the
+        beginning of the loop and mark(phase) at the end of every phase. '''
+
+    def __init__(self, phases):
+        self.phases = phases
+        self.stats = { phase: TimingStats() for phase in phases }
+        self._last_time = None
+
+    def start(self):
+        self._last_time = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.stats[phase].add(now - self._last_time)
+        self._last_time = now
+
+    def get_stats(self):
+        return [ (phase, self.stats[phase].summary()) for phase in self.phases ]
+
+
+class TimedLock(object):
+    ''' Drop-in replacement for threading.Lock that records how long
+        threads wait to acquire the lock and how long they hold it '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._acquired_time = 0.0
+        self.wait_stats = TimingStats()
+        self.hold_stats = TimingStats()
+
+    def acquire(self, blocking=True, timeout=-1):
+        start_time = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_time = time.perf_counter()
+            self.wait_stats.add(self._acquired_time - start_time)
+        return acquired
+
+    def release(self):
+        # The stats are only ever updated while holding the lock
+        self.hold_stats.add(time.perf_counter() - self._acquired_time)
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def get_stats(self):
+        return { 'wait': self.wait_stats.summary(), 'hold': self.hold_stats.summary() }
+
+
+def format_timing_stats(title, rows):
+    ''' Formats (label, TimingStats summary) rows into a table with the
+        durations shown in milliseconds '''
+    lines = [ '{}:'.format(title) ]
+    width = max([ len(label) for label, _ in rows ] + [ 0 ]) + 4
+    for label, s in rows:
+        lines.append('\t{label:{width}}count={count:<8} mean={mean:<8.2f} p50={p50:<8.2f} '
+                     'p95={p95:<8.2f} p99={p99:<8.2f} max={max:.2f} (ms)'.format(
+                        label=label,
+                        width=width,
+                        count=s['count'],
+                        mean=s['mean'] * 1000.0,
+                        p50=s['p50'] * 1000.0,
+                        p95=s['p95'] * 1000.0,
+                        p99=s['p99'] * 1000.0,
+                        max=s['max'] * 1000.0))
+    return '\n'.join(lines)
+
+
+def format_stats(engine, target):
+    ''' Returns a human readable summary of the requested engine
+        statistics or None if the target is unknown '''
+    if target == 'lock':
+        lock_stats = engine.lock.get_stats()
+        return format_timing_stats('Engine lock', [
+            ('wait', lock_stats['wait']),
+            ('hold', lock_stats['hold']) ])
+
+    if target == 'modules':
+        module_stats = sorted(engine.get_module_stats().items())
+        lines = [ format_timing_stats('Module runtime', [ (name, s['runtime']) for name, s in module_stats ]) ]
+        lines.append('Module counters:')
+        for name, s in module_stats:
+            lines.append('\t{} calls={} skipped={} overruns={} crashes={} total={:.2f}ms'.format(
+                name, s['calls'], s['skipped'], s['overruns'], s['crashes'], s['runtime']['total'] * 1000.0))
+        return '\n'.join(lines)
+
+    if target == 'outputs':
+        output_stats = engine.get_output_stats()
+        counters = ('Output queue depth={queue_depth} stalled clients={stalled_clients} '
+                    'superseded={superseded} failed={failed} dropped={dropped}'.format(**output_stats))
+        return counters + '\n' + format_timing_stats('Output write latency', [
+            ('write', output_stats['write']) ])
+
+    if target == 'tick':
+        tick_stats = engine.get_tick_stats()
+        counters = 'Tick overruns={overruns} skipped={skipped}'.format(**tick_stats)
+        return counters + '\n' + format_timing_stats('Tick start delay', [
+            ('jitter', tick_stats['jitter']) ])
+
+    if target == 'engine':
+        engine_stats = engine.get_engine_stats()
+        lines = [ format_timing_stats('Tick phases', engine_stats['phases']) ]
+        clients = sorted(engine_stats['clients'].items())
+        lines.append(format_timing_stats('Client poll latency', [ (alias, s['latency']) for alias, s in clients ]))
+        lines.append('Client poll failures and timeouts:')
+        for alias, s in clients:
+            lines.append('\t{} errors={} timeouts={} breaker={} timeout={:.0f}ms'.format(
+                alias, s['errors'], s['timeouts'], s['breaker'], s['timeout'] * 1000.0))
+        return '\n'.join(lines)
+
+    if target == 'graph':
+        graph = engine.get_module_graph()
+        lines = [ 'Module evaluation order: {}'.format(', '.join(graph.order)) ]
+        lines.append('Critical path length={} ({})'.format(
+                graph.critical_path_length(), ' -> '.join(graph.critical_path)))
+        for cycle in graph.cycles:
+            lines.append('Cycle: {}'.format(' -> '.join(cycle)))
+        return '\n'.join(lines)
+
+    return None
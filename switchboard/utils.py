@@ -29,6 +29,14 @@ def is_float(string):
         return False
 
 
+def is_int(string):
+    try:
+        int(string)
+        return True
+    except:
+        return False
+
+
 def get_free_port():
     ''' Let the OS figure out a free port that we can use '''
     import socket
@@ -0,0 +1,154 @@
+
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from switchboard.device import RESTDevice, SignalDevice
+
+
+# Columns holding arbitrary device values
+_OBJECT_COLUMNS = [ 'value', 'previous_value', 'last_set_value', 'error' ]
+
+# Columns backing the value attributes of a device
+_DEVICE_COLUMNS = _OBJECT_COLUMNS + [ 'last_update_time' ]
+
+
+class ValueStore(object):
+    ''' Columnar store for the values of the Switchboard devices. The
+        value, previous value, last set value, last update time and error
+        of every device are kept in arrays indexed by the device id, and
+        the devices created with the store are thin views over them.
+
+        This lets the engine find the devices that changed with a single
+        vectorised comparison per tick rather than by comparing every
+        device object. Requires NumPy. '''
+
+    def __init__(self, capacity=64):
+        if numpy is None:
+            raise ImportError('The columnar value store requires NumPy')
+
+        self.value = numpy.empty(capacity, dtype=object)
+        self.previous_value = numpy.empty(capacity, dtype=object)
+        self.last_set_value = numpy.empty(capacity, dtype=object)
+        self.error = numpy.empty(capacity, dtype=object)
+        self.last_update_time = numpy.zeros(capacity)
+
+        # Device using each id, None for free ids
+        self.devices = numpy.empty(capacity, dtype=object)
+
+        # Last update times as of the last call to take_changes()
+        self._taken_update_time = numpy.zeros(capacity)
+
+        # Number of ids handed out so far and the released ids
+        self._size = 0
+        self._free_ids = []
+
+    def allocate(self, device):
+        ''' Returns a new device id for the given device '''
+        if self._free_ids:
+            index = self._free_ids.pop()
+        else:
+            if self._size == len(self.devices):
+                self._grow()
+            index = self._size
+            self._size += 1
+
+        self.devices[index] = device
+        self.last_update_time[index] = time.monotonic()
+        self._taken_update_time[index] = numpy.nan
+        return index
+
+    def release(self, index):
+        ''' Frees the id of a device that has been removed '''
+        for column in _OBJECT_COLUMNS + [ 'devices' ]:
+            getattr(self, column)[index] = None
+        self._free_ids.append(index)
+
+    def take_changes(self):
+        ''' Returns the devices that were updated or set since the last
+            call. Every value change and every output set bumps the
+            update time of a device so only the update times need to be
+            compared. '''
+        size = self._size
+        changed = numpy.flatnonzero(self.last_update_time[:size] != self._taken_update_time[:size])
+        self._taken_update_time[changed] = self.last_update_time[changed]
+        return [ device for device in self.devices[changed] if device is not None ]
+
+    def _grow(self):
+        capacity = 2 * len(self.devices)
+        for column in _OBJECT_COLUMNS + [ 'devices' ]:
+            grown = numpy.empty(capacity, dtype=object)
+            grown[:self._size] = getattr(self, column)[:self._size]
+            setattr(self, column, grown)
+
+        for column in [ 'last_update_time', '_taken_update_time' ]:
+            grown = numpy.zeros(capacity)
+            grown[:self._size] = getattr(self, column)[:self._size]
+            setattr(self, column, grown)
+
+
+class _DetachedRow(object):
+    ''' Single row holding the values of a device that isn't in a
+        ValueStore, either because it hasn't been validated yet or because
+        it was released. Modules still holding a released device keep
+        their own copy of its last values, as they would with plain
+        device objects, rather than the values of whichever device gets
+        its id next. '''
+
+    def __init__(self, store=None, index=None):
+        for column in _DEVICE_COLUMNS:
+            setattr(self, column, [ getattr(store, column)[index] if store is not None else None ])
+
+
+def _column_property(column):
+    def get(self):
+        return getattr(self._store, column)[self._index]
+
+    def set(self, value):
+        getattr(self._store, column)[self._index] = value
+
+    return property(get, set)
+
+
+class _ColumnarDevice(object):
+    ''' Replaces the value attributes of a device with views of its row
+        in a ValueStore '''
+    __slots__ = ()
+
+    value = _column_property('value')
+    previous_value = _column_property('previous_value')
+    last_set_value = _column_property('last_set_value')
+    last_update_time = _column_property('last_update_time')
+    error = _column_property('error')
+
+    def __init__(self, store, *args):
+        # Only take a row in the store once the device has been validated
+        # so that a rejected device doesn't leak it
+        self._store = _DetachedRow()
+        self._index = 0
+        super(_ColumnarDevice, self).__init__(*args)
+
+        row = self._store
+        self._store = store
+        self._index = store.allocate(self)
+        for column in _DEVICE_COLUMNS:
+            getattr(store, column)[self._index] = getattr(row, column)[0]
+
+    def release(self):
+        ''' Frees the row of the device. The device keeps its last values
+            in a row of its own as modules may still refer to it. '''
+        store, index = self._store, self._index
+        self._store = _DetachedRow(store, index)
+        self._index = 0
+        store.release(index)
+
+
+class ColumnarRESTDevice(_ColumnarDevice, RESTDevice):
+    __slots__ = ( '_store', '_index' )
+
+
+class ColumnarSignalDevice(_ColumnarDevice, SignalDevice):
+    __slots__ = ( '_store', '_index' )
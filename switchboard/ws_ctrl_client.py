@@ -100,6 +100,9 @@ class WSCtrlClient(WSIODataClient):
         # Stores the last known state of the Switchboard config
         self.swb_config = {}
 
+        # Stores the last statistics sent by Switchboard
+        self.swb_stats = {}
+
         # Websocket app used to communicate with the ws_ctrl server
         self.ws = None
 
@@ -116,6 +119,11 @@ class WSCtrlClient(WSIODataClient):
                 self.swb_config = copy.deepcopy(msg_data['config'])
             self.ws_handler.update_current_config(self.swb_config)
 
+        elif msg_data['command'] == 'update_stats':
+            with self.lock:
+                self.swb_stats = msg_data['stats']
+            self.ws_handler.update_stats(self.swb_stats)
+
         elif msg_data['command'] == 'response':
             self.response_queue.put(msg_data)
 
@@ -205,3 +213,7 @@ class WSCtrlHandlerBase(WSIODataHandlerBase):
     def update_current_config(self, config):
         '''update_current_config method required to update the current Switchboard config'''
         raise NotImplementedError(self.update_current_config.__doc__)
+
+    def update_stats(self, stats):
+        '''update_stats method called with the latest Switchboard statistics. Optional.'''
+        pass
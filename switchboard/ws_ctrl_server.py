@@ -2,14 +2,18 @@
 import json
 import sys
 import logging
+from collections import deque, OrderedDict
 from threading import Thread, Lock
 
-from bottle import Bottle, static_file
+import gevent
+from gevent.event import Event
+from bottle import Bottle, static_file, request, response
 from bottle.ext.websocket import GeventWebSocketServer, websocket
 
 import os
 module_path = os.path.dirname(os.path.realpath(__file__))
 
+from switchboard.device import get_update_datetime
 from switchboard.utils import get_free_port
 from switchboard.command_decoder import CommandDecoder
 
@@ -24,7 +28,7 @@ def _make_state_table(clients):
         devices_entries = client_entry['devices']
         for _, d_obj in sorted(client.devices.items()):
             device_entry = {
-                'last_update_time': str(d_obj.last_update_time),
+                'last_update_time': str(get_update_datetime(d_obj.last_update_time)),
                 'name': d_obj.name,
                 'value': d_obj.value,
                 'last_set_value': d_obj.last_set_value }
@@ -33,15 +37,140 @@ def _make_state_table(clients):
     return table
 
 
+class _Subscriber(object):
+    ''' Outgoing messages of a websocket. Messages can be queued from any
+        thread and are sent by a greenlet of the server so that the engine
+        never waits on a slow websocket.
+
+        Subscribers that can be resynchronised with a fresh state table
+        (get_table is given) cope with falling behind: once more than
+        coalesce_threshold messages are queued the pending field updates
+        are merged into a single message with the latest value of every
+        device, and once the queue is full it is replaced by the state
+        table. Other subscribers that let their queue fill up are
+        disconnected. '''
+
+    def __init__(self, ws, max_queue, coalesce_threshold=None, get_table=None):
+        self.ws = ws
+        self.max_queue = max_queue
+        self.coalesce_threshold = coalesce_threshold
+        self._get_table = get_table
+        self.overflowed = False
+
+        # Number of times the queue was coalesced or replaced by the table
+        self.coalesced = 0
+        self.resyncs = 0
+
+        # Queue of (serialized message, fields, is_table) tuples where
+        # fields are the device updates of update_fields messages
+        self._queue = deque()
+
+        # Wakes the greenlet up. Must be created in the server thread,
+        # the watcher's send() is the only thread-safe way into its hub.
+        self._ready = Event()
+        self._wakeup = gevent.get_hub().loop.async_()
+        self._wakeup.start(self._ready.set)
+        self._closed = False
+
+    def send(self, data, fields=None, is_table=False):
+        ''' Queue a serialized message. fields are the device updates of
+            an update_fields message. '''
+        if self._closed or self.overflowed:
+            return
+
+        if len(self._queue) < self.max_queue:
+            self._queue.append((data, fields, is_table))
+        elif self._get_table:
+            # The table already includes the updates being sent
+            logger.warning('Websocket client is {} messages behind, sending it the state table'.format(
+                len(self._queue)))
+            self.resyncs += 1
+            self._queue.clear()
+            self._queue.append((self._get_table(), None, True))
+        else:
+            logger.warning('Disconnecting websocket client that is {} messages behind'.format(
+                len(self._queue)))
+            self.overflowed = True
+            self._queue.clear()
+        self._wakeup.send()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.send()
+
+    def run(self):
+        ''' Send the queued messages until the subscriber is closed '''
+        try:
+            while not self._closed:
+                self._ready.wait()
+                self._ready.clear()
+                if self.overflowed:
+                    self.ws.close()
+                    break
+                while self._queue and not self._closed:
+                    if self.coalesce_threshold and len(self._queue) > self.coalesce_threshold:
+                        messages = self._coalesce()
+                    else:
+                        messages = self._pop(1)
+                    for data, _, _ in messages:
+                        self.ws.send(data)
+        except Exception as e:
+            logger.info('Websocket client disconnected: {}'.format(e))
+        finally:
+            self._closed = True
+            self._wakeup.close()
+
+    def _pop(self, count):
+        ''' Takes up to count messages off the queue. The queue may be
+            cleared by another thread at any time. '''
+        messages = []
+        try:
+            while len(messages) < count:
+                messages.append(self._queue.popleft())
+        except IndexError:
+            pass
+        return messages
+
+    def _coalesce(self):
+        ''' Takes all the queued messages and merges the field updates
+            into one message with the latest value of every device. A
+            queued table replaces everything queued before it. '''
+        self.coalesced += 1
+        table = None
+        fields = OrderedDict()
+        others = []
+        for message in self._pop(len(self._queue)):
+            data, message_fields, is_table = message
+            if is_table:
+                table = message
+                fields.clear()
+                others = []
+            elif message_fields is None:
+                others.append(message)
+            else:
+                for field in message_fields:
+                    fields.pop(field['device'], None)
+                    fields[field['device']] = field
+
+        messages = [ table ] if table else []
+        messages += others
+        if fields:
+            fields = list(fields.values())
+            messages.append((json.dumps({ 'command': 'update_fields', 'fields': fields }), fields, False))
+        return messages
+
+
 class WSCtrlServer:
     ''' WSCtrlServer receives the entire Switchboard IO state at every tick
         and converts the progression of the IO state into a list of diffs.
 
-        All agents are notified every time there is an update. '''
+        All agents are notified every time there is an update. Every
+        message is serialized once and queued for each agent. '''
 
     def __init__(self, config):
         self._config = config
         self._decoder = None
+        self._engine = None
 
         # Register the callback to be executed whenever the config is updated
         self._config.register_config_update_handler(
@@ -50,15 +179,25 @@ class WSCtrlServer:
         # The last known state of the Switchboard IOs
         self.current_state_table = []
 
+        # Map of device name -> device entry of the current state table
+        self._table_entries = {}
+
+        # Serialized update_table message of the current state table
+        self._table_data = None
+
         # Lock used to synchronise updates and the connection listener
         self._lock = Lock()
 
         self._iodata_clients = set()
         self._ctrl_clients = set()
 
+        # The last statistics sent by the engine
+        self._stats = None
+
     def set_dependencies(self, engine, app_manager):
         assert not self._decoder
         self._decoder = CommandDecoder(self._config, engine, app_manager)
+        self._engine = engine
 
     def init_config(self):
         self.port = self._config.get('ws_port')
@@ -73,21 +212,75 @@ class WSCtrlServer:
         self._app.route('/ws_iodata', method='GET', callback=self._ws_iodata_connection, apply=[websocket])
         self._app.route('/ws_ctrl', method='GET', callback=self._ws_ctrl_connection, apply=[websocket])
 
-        thread = Thread(target=self.run)
-        thread.daemon = True
-        thread.start()
+        # Clients push their values to a separate server so that it can
+        # be reachable from the network while ws_ctrl, which has full
+        # control of Switchboard, only listens on localhost
+        self.push_port = self._config.get('push_port')
+        if not self.push_port:
+            self.push_port = get_free_port()
+
+        self._config.set('push_port', self.push_port)
+        logger.info('Push server listening on port {}'.format(self.push_port))
+
+        self._push_app = Bottle()
+        self._push_app.route('/devices_push', method='PUT', callback=self._devices_push)
+
+        for target in [ self.run, self.run_push_server ]:
+            thread = Thread(target=target)
+            thread.daemon = True
+            thread.start()
 
     def run(self):
         self._app.run(host='localhost', port=self.port, debug=False, quiet=True, server=GeventWebSocketServer)
 
+    def run_push_server(self):
+        host = self._config.get('push_host') or 'localhost'
+        self._push_app.run(host=host, port=self.push_port, debug=False, quiet=True, server=GeventWebSocketServer)
+
     def _index(self):
         return static_file('index.html', root=module_path + '/views/')
 
+    def _devices_push(self):
+        ''' Clients in push mode send their device value changes here as
+            { "epoch": <epoch>, "devices": [ { "name": <name>, "value": <value> }, ... ] } '''
+        response.headers['Content-Type'] = 'application/json'
+        retval = { }
+
+        try:
+            data = json.loads(request.body.read().decode('ascii'))
+        except:
+            data = None
+
+        if not isinstance(data, dict):
+            retval['error'] = 'Unable to decode json data from PUT request'
+        elif not self._engine:
+            retval['error'] = 'Switchboard is not ready'
+        else:
+            error = self._engine.push_client_values(data)
+            if error:
+                retval['error'] = error
+
+        return json.dumps(retval)
+
+    def _subscribe(self, ws, iodata=False):
+        ''' Start the greenlet sending the messages queued for ws. IOData
+            subscribers that fall behind are caught up with coalesced
+            updates or a fresh state table. '''
+        max_queue = int(self._config.get('ws_queue_size') or 100)
+        if iodata:
+            subscriber = _Subscriber(ws, max_queue,
+                    int(self._config.get('ws_coalesce_threshold') or 10), self._get_table_data)
+        else:
+            subscriber = _Subscriber(ws, max_queue)
+        gevent.spawn(subscriber.run)
+        return subscriber
+
     def _ws_iodata_connection(self, ws):
         ''' A client receives IOData and can send a limited amount of commands '''
+        subscriber = self._subscribe(ws, iodata=True)
         with self._lock:
-            self._iodata_clients.add(ws)
-            self.send_state_table([ws])
+            self._iodata_clients.add(subscriber)
+            self.send_state_table([subscriber])
 
         while True:
             msg = ws.receive()
@@ -95,44 +288,58 @@ class WSCtrlServer:
                 break
 
         with self._lock:
-            self._iodata_clients.remove(ws)
+            self._iodata_clients.remove(subscriber)
+        subscriber.close()
 
     def _ws_ctrl_connection(self, ws):
         ''' A ctrl connection receives IOData, status etc. and has full control over Switchboard '''
+        subscriber = self._subscribe(ws)
         with self._lock:
-            self._ctrl_clients.add(ws)
-            self.send_current_config([ws])
+            self._ctrl_clients.add(subscriber)
+            self.send_current_config([subscriber])
+            if self._stats:
+                self.send_stats(self._stats, [subscriber])
 
         while True:
             msg = ws.receive()
             if msg is None:
                 break
-            self._decoder.decode_ctrl_command(ws, msg)
+            # Responses are queued like any other message
+            self._decoder.decode_ctrl_command(subscriber, msg)
 
         with self._lock:
-            self._ctrl_clients.remove(ws)
+            self._ctrl_clients.remove(subscriber)
+        subscriber.close()
 
-    def _determine_table_updates(self, devices):
+    def _determine_table_updates(self, devices, changed=None):
+        ''' Compares the devices with the state table. If the names of the
+            devices that changed are given only those are compared. '''
         updates = []
 
-        for client_entry in self.current_state_table:
-            for device in client_entry['devices']:
-                d_obj = devices[device['name']]
-                last_update_time = str(d_obj.last_update_time)
-                if device['value'] != d_obj.value or \
-                        device['last_set_value'] != d_obj.last_set_value or \
-                        device['last_update_time'] != last_update_time:
-
-                    update = {'last_update_time': last_update_time,
-                            'device': d_obj.name,
-                            'value': d_obj.value,
-                            'last_set_value': d_obj.last_set_value }
-                    updates.append(update)
-
-                    # Update the current_state_table
-                    device['last_update_time'] = last_update_time
-                    device['value'] = d_obj.value
-                    device['last_set_value'] = d_obj.last_set_value
+        if changed is None:
+            entries = [ device for client_entry in self.current_state_table
+                               for device in client_entry['devices'] ]
+        else:
+            # Internal signals aren't part of the table
+            entries = [ self._table_entries[name] for name in changed if name in self._table_entries ]
+
+        for device in entries:
+            d_obj = devices[device['name']]
+            last_update_time = str(get_update_datetime(d_obj.last_update_time))
+            if device['value'] != d_obj.value or \
+                    device['last_set_value'] != d_obj.last_set_value or \
+                    device['last_update_time'] != last_update_time:
+
+                update = {'last_update_time': last_update_time,
+                        'device': d_obj.name,
+                        'value': d_obj.value,
+                        'last_set_value': d_obj.last_set_value }
+                updates.append(update)
+
+                # Update the current_state_table
+                device['last_update_time'] = last_update_time
+                device['value'] = d_obj.value
+                device['last_set_value'] = d_obj.last_set_value
 
         return updates
 
@@ -140,31 +347,54 @@ class WSCtrlServer:
         ''' This function is called if the table structure should be updated.
             This happens when clients or devices are added or removed. '''
         self.current_state_table = []
+        self._table_entries = {}
+        self._table_data = None
 
-    def take_snapshot(self, clients, devices):
+    def take_snapshot(self, clients, devices, changed=None):
         ''' Takes a snapshot of the current IO state and notifies consumers
-            of any updates '''
+            of any updates. changed is an optional set of the names of
+            the devices that changed since the last snapshot, without it
+            every device is compared. '''
         with self._lock:
             if self.current_state_table:
-                updates = self._determine_table_updates(devices)
+                updates = self._determine_table_updates(devices, changed)
                 if updates:
+                    self._table_data = None
                     self.send_updates(updates)
             else:
                 # The state table has been reset. Create a new one.
                 self.current_state_table = _make_state_table(clients)
+                self._table_entries = { device['name']: device
+                                        for client_entry in self.current_state_table
+                                        for device in client_entry['devices'] }
+                self._table_data = None
                 self.send_state_table(self._iodata_clients)
 
     def send_updates(self, updates):
-        data = { 'command': 'update_fields', 'fields': updates }
+        data = json.dumps({ 'command': 'update_fields', 'fields': updates })
         for ws in self._iodata_clients:
-            ws.send(json.dumps(data))
+            ws.send(data, updates)
 
     def send_state_table(self, wss):
-        data = { 'command': 'update_table', 'table': self.current_state_table }
+        data = self._get_table_data()
         for ws in wss:
-            ws.send(json.dumps(data))
+            ws.send(data, is_table=True)
+
+    def _get_table_data(self):
+        ''' Returns the serialized state table. Must be called while
+            holding the lock. '''
+        if self._table_data is None:
+            self._table_data = json.dumps({ 'command': 'update_table', 'table': self.current_state_table })
+        return self._table_data
+
+    def send_stats(self, stats, wss=None):
+        ''' Sends the engine statistics to the ctrl clients '''
+        self._stats = stats
+        data = json.dumps({ 'command': 'update_stats', 'stats': stats })
+        for ws in list(self._ctrl_clients if wss is None else wss):
+            ws.send(data)
 
     def send_current_config(self, wss):
-        data = { 'command': 'update_config', 'config': self._config.configs }
-        for ws in wss:
-            ws.send(json.dumps(data))
+        data = json.dumps({ 'command': 'update_config', 'config': self._config.configs })
+        for ws in list(wss):
+            ws.send(data)
@@ -0,0 +1,29 @@
+''' Module evaluated in a worker process by test_switchboard_module.py. It
+    has to be importable by the worker so it can't be defined in the test '''
+
+import os
+
+from switchboard.module import SwitchboardModule
+
+
+@SwitchboardModule(
+        inputs = [ 'input2.i' ],
+        outputs = { 'output1.o': None, 'output2.io': None },
+        static_variables = { 'count': 0 },
+        executor = 'process')
+def process_module(in2, out1, out2):
+    process_module.count += 1
+    out1.set_value(in2.get_value() * 2)
+    out2.set_value((process_module.count, os.getpid()))
+
+
+@SwitchboardModule(
+        inputs = [ 'input2.i' ],
+        outputs = { 'output2.io': None },
+        static_variables = { 'count': 0 },
+        executor = 'process',
+        time_budget = 0.05,
+        max_overruns = 1)
+def budget_process_module(in2, out2):
+    budget_process_module.count += 1
+    out2.set_value((budget_process_module.count, os.getpid()))
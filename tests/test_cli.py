@@ -117,6 +117,12 @@ COMMANDS = [
     {  'name': 'remove',        'args': ['client1'] },
     {  'name': 'set',           'args': ['poll_period', '2'] },
     {  'name': 'start',         'args': [] },
+    {  'name': 'stats',         'args': ['engine'] },
+    {  'name': 'stats',         'args': ['graph'] },
+    {  'name': 'stats',         'args': ['lock'] },
+    {  'name': 'stats',         'args': ['modules'] },
+    {  'name': 'stats',         'args': ['outputs'] },
+    {  'name': 'stats',         'args': ['tick'] },
     {  'name': 'stop',          'args': [] },
     {  'name': 'updateclient',  'args': ['client1'] },
     {  'name': 'updateclient',  'args': ['client1', '1.3'] },
@@ -0,0 +1,34 @@
+from switchboard.circuit_breaker import CircuitBreaker
+
+
+def test_breaker_opens_and_backs_off():
+    breaker = CircuitBreaker(base_backoff=1.0)
+
+    assert not breaker.record_failure(3, 8.0, now=0.0)
+    assert not breaker.record_failure(3, 8.0, now=0.0)
+    assert breaker.allow_request(now=0.0)
+
+    assert breaker.record_failure(3, 8.0, now=0.0)
+    assert breaker.is_open()
+    assert not breaker.allow_request(now=0.5)
+    assert breaker.allow_request(now=1.0)
+
+    # Every failed probe doubles the backoff up to the max
+    for expected in [ 2.0, 4.0, 8.0, 8.0 ]:
+        breaker.record_failure(3, 8.0, now=10.0)
+        assert breaker.backoff == expected
+        assert breaker.next_probe == 10.0 + expected
+
+
+def test_breaker_closes_on_success():
+    breaker = CircuitBreaker()
+    assert not breaker.record_success()
+
+    for _ in range(3):
+        breaker.record_failure(3, 60.0, now=0.0)
+    assert breaker.record_success()
+    assert not breaker.is_open()
+    assert breaker.allow_request(now=0.0)
+
+    # The failures are counted from scratch
+    assert not breaker.record_failure(3, 60.0, now=0.0)
@@ -0,0 +1,95 @@
+
+import io
+import json
+
+import bottle
+from mock import MagicMock
+
+from switchboard.client import SwitchboardClient, SwitchboardInputDevice, SwitchboardOutputDevice
+
+
+def put_request(body):
+    ''' Sets up the bottle request as if it was a PUT request with the given body '''
+    data = json.dumps(body).encode('ascii')
+    bottle.request.bind({
+        'REQUEST_METHOD': 'PUT',
+        'CONTENT_LENGTH': str(len(data)),
+        'wsgi.input': io.BytesIO(data) })
+
+
+def test_devices_set():
+    client = SwitchboardClient()
+    out1 = MagicMock()
+    out2 = MagicMock()
+    client.add_device(SwitchboardOutputDevice('out1.o', out1))
+    client.add_device(SwitchboardOutputDevice('out2.o', out2))
+    client.add_device(SwitchboardInputDevice('in.i', lambda: 1))
+
+    put_request({ 'devices': [ { 'name': 'out1.o', 'value': '1' },
+                               { 'name': 'in.i', 'value': '2' },
+                               { 'name': 'out2.o', 'value': '3' } ] })
+    response = json.loads(client._devices_set())
+
+    # The input can't be set but the other outputs are still set
+    out1.assert_called_once_with('1')
+    out2.assert_called_once_with('3')
+    assert 'in.i' in response['error']
+
+
+def test_devices_set_bad_request():
+    client = SwitchboardClient()
+    put_request({ 'name': 'out1.o', 'value': '1' })
+    response = json.loads(client._devices_set())
+    assert 'error' in response
+
+
+def test_devices_value_delta():
+    client = SwitchboardClient()
+    values = { 'a': 1, 'b': 2 }
+    client.add_device(SwitchboardInputDevice('a.i', lambda: values['a']))
+    client.add_device(SwitchboardInputDevice('b.i', lambda: values['b']))
+
+    full = client._get_devices_value_response()
+    assert full['delta'] == False
+    assert len(full['devices']) == 2
+
+    # Nothing changed
+    response = client._get_devices_value_response(full['seq'], full['epoch'])
+    assert response['delta'] == True
+    assert response['devices'] == []
+    assert response['seq'] == full['seq']
+
+    values['b'] = 3
+    response = client._get_devices_value_response(full['seq'], full['epoch'])
+    assert response['devices'] == [ { 'name': 'b.i', 'value': 3 } ]
+    assert response['seq'] > full['seq']
+
+    # Unknown epochs and sequence numbers get the full set of values
+    assert len(client._get_devices_value_response(full['seq'], 'other')['devices']) == 2
+    assert len(client._get_devices_value_response(response['seq'] + 1, full['epoch'])['devices']) == 2
+
+
+def test_push_changes():
+    client = SwitchboardClient(push_url='http://engine/devices_push')
+    values = { 'a': 1 }
+    client.add_device(SwitchboardInputDevice('a.i', lambda: values['a']))
+    client._push_session = MagicMock()
+    client._push_session.put.return_value.json.return_value = { 'error': 'Unknown client epoch' }
+
+    # Rejected values are pushed again
+    assert client.push_changes() == False
+    client._push_session.put.return_value.json.return_value = {}
+    assert client.push_changes() == True
+    assert client._push_session.put.call_count == 2
+    body = json.loads(client._push_session.put.call_args[1]['data'])
+    assert body['epoch'] == client._epoch
+    assert body['devices'] == [ { 'name': 'a.i', 'value': 1 } ]
+
+    # Nothing is pushed if nothing changed
+    assert client.push_changes() == True
+    assert client._push_session.put.call_count == 2
+
+    values['a'] = 2
+    assert client.push_changes() == True
+    body = json.loads(client._push_session.put.call_args[1]['data'])
+    assert body['devices'] == [ { 'name': 'a.i', 'value': 2 } ]
@@ -1,8 +1,12 @@
 
+import sys
+import time
+from datetime import datetime, timedelta
+
 import pytest
 from mock import MagicMock
 
-from switchboard.device import get_device_suffix, RESTDevice, SwitchboardDevice
+from switchboard.device import get_device_suffix, get_update_datetime, RESTDevice, SignalDevice, SwitchboardDevice
 
 def test_get_device_suffix():
     test_cases = [  [ 'name_without_fullstop',  None ],
@@ -96,3 +100,30 @@ def test_rest_io_device():
     assert(hasattr(dev, 'set_value'))
 
 
+
+
+def test_compact_devices():
+    # Build the name at runtime so that it isn't already interned
+    dev = RESTDevice({ 'name': '.'.join([ 'output', 'io' ]), 'readable': True, 'writeable': True },
+            'http://test_url',
+            None)
+    signal = SignalDevice('signal.s')
+
+    for obj in [ dev, signal, dev.input_signal, dev.output_signal ]:
+        assert not hasattr(obj, '__dict__')
+
+    assert dev.name is sys.intern('output.io')
+
+
+def test_last_update_time():
+    device = SwitchboardDevice('input.i')
+    before = time.monotonic()
+    device.update_value(1)
+    assert before <= device.last_update_time <= time.monotonic()
+
+    # Unchanged values don't update the time
+    last_update_time = device.last_update_time
+    device.update_value(1)
+    assert device.last_update_time == last_update_time
+
+    assert abs(get_update_datetime(last_update_time) - datetime.now()) < timedelta(seconds=1)
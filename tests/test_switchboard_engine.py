@@ -1,17 +1,21 @@
 
+import json
 from copy import deepcopy
 
 import pytest
 import time
+import requests
 from threading import Thread
 from mock import MagicMock
 
-from switchboard.engine import SwitchboardEngine, EngineError, _Client
+from switchboard.engine import SwitchboardEngine, EngineError, _ClientInfo
 from switchboard.module import SwitchboardModule
+from switchboard.device import RESTDevice
 
 class TimeElapsed:
     def __enter__(self):
         self.start_time = time.time()
+        return self
 
     def __exit__(self, type, value, traceback):
         self.elapsed = time.time() - self.start_time
@@ -24,6 +28,11 @@ class EngineTest(SwitchboardEngine):
         self.configs = { 'poll_period': 0.05 }
         self.running = True
         self.modules = { 'mod1': MagicMock(), 'mod2': MagicMock() }
+        self._update_module_graph()
+        self.send_stats = MagicMock()
+
+    def get(self, key):
+        return self.configs.get(key)
 
 
 def test_terminate():
@@ -107,7 +116,7 @@ def test_add_and_update_client():
     with pytest.raises(EngineError):
         eng.add_client('http://abc', 'client1')
 
-    eng.clients = { 'client1': _Client('http://abc', None, None, None) }
+    eng.clients = { 'client1': _ClientInfo('http://abc', None, None, None) }
     with pytest.raises(EngineError):
         eng.add_client('http://abc', 'client2')
 
@@ -117,6 +126,307 @@ def test_add_and_update_client():
     eng._upsert_client.assert_not_called()
 
 
+def test_parallel_polling():
+    ''' Clients are polled concurrently but applied in client order '''
+    eng = EngineTest()
+    eng.configs['poll_workers'] = '4'
+    clients = [ _ClientInfo('http://c{}'.format(i), 'c{}'.format(i), {}, None) for i in range(4) ]
+    eng.clients = { c.alias: c for c in clients }
+
+    def fetch(client):
+        time.sleep(0.05)
+        return { 'devices': [] }, None
+
+    applied = []
+    eng._fetch_client_values = fetch
+    eng._apply_client_values = lambda client, values_json, error: applied.append(client)
+
+    with TimeElapsed() as t:
+        eng._update_devices_values(clients)
+
+    assert t.elapsed < 0.15
+    assert applied == clients
+
+
+def test_client_session_reused():
+    ''' All the requests to a client go through its keep-alive session '''
+    eng = EngineTest()
+    eng.reset_table = MagicMock()
+    session = MagicMock()
+    session.get.return_value.json.return_value = { 'devices': [] }
+    client = _ClientInfo('http://abc', 'abc', {}, None, session)
+    eng.clients = { 'abc': client }
+
+    eng._update_devices_values([client])
+    eng._update_devices_values([client])
+    assert session.get.call_count == 2
+
+    eng.remove_client('abc')
+    session.close.assert_called_once()
+
+
+def test_delta_polling():
+    ''' Once a client reports a sequence number only changes are requested '''
+    eng = EngineTest()
+    session = MagicMock()
+    session.get.return_value.json.return_value = {
+            'devices': [ { 'name': 'a.i', 'value': 1 }, { 'name': 'b.i', 'value': 2 } ],
+            'seq': 4, 'epoch': 'e', 'delta': False }
+    devices = {}
+    for name in [ 'abc.a.i', 'abc.b.i' ]:
+        devices[name] = RESTDevice({ 'name': name, 'readable': True, 'writeable': False },
+                                   'http://abc', None)
+    device = devices['abc.b.i']
+    client = _ClientInfo('http://abc', 'abc', devices, None, session)
+    client.compile_ingest_plan()
+    eng.clients = { 'abc': client }
+    eng.devices = dict(devices)
+
+    eng._update_devices_values([client])
+    assert session.get.call_args[1]['params'] == None
+    assert (client.seq, client.epoch) == (4, 'e')
+
+    session.get.return_value.json.return_value = {
+            'devices': [], 'seq': 4, 'epoch': 'e', 'delta': True }
+    eng._update_devices_values([client])
+    assert session.get.call_args[1]['params'] == { 'since': 4, 'epoch': 'e' }
+    assert device.previous_value == 2
+    assert not device.input_signal.has_changed()
+
+    # Changes that arrive through a delta are seen by the modules and the
+    # devices left out of it are aged
+    session.get.return_value.json.return_value = {
+            'devices': [ { 'name': 'b.i', 'value': 3 } ], 'seq': 5, 'epoch': 'e', 'delta': True }
+    eng._update_devices_values([client])
+    assert device.value == 3
+    assert device.previous_value == 2
+    assert device.input_signal.has_changed()
+    assert not devices['abc.a.i'].input_signal.has_changed()
+
+    # After an error the full set of values is requested again
+    session.get.side_effect = Exception()
+    eng._update_devices_values([client])
+    assert client.seq is None
+
+
+def test_poll_outside_lock():
+    ''' Clients are fetched without holding the lock and applied with it '''
+    eng = EngineTest()
+    eng.configs['poll_period'] = 0.0
+    eng.take_snapshot = MagicMock()
+    client = _ClientInfo('http://abc', 'abc', {}, None)
+    eng.clients = { 'abc': client }
+
+    def fetch(client):
+        assert not eng.lock.locked()
+        return { 'devices': [] }, None
+
+    def apply(client, values_json, error):
+        assert eng.lock.locked()
+
+    eng._fetch_client_values = MagicMock(side_effect=fetch)
+    eng._apply_client_values = MagicMock(side_effect=apply)
+    eng.switchboard_loop()
+
+    eng._fetch_client_values.assert_called_once_with(client)
+    eng._apply_client_values.assert_called_once()
+    assert eng.lock.get_stats()['hold']['count'] == 2
+
+
+def test_removed_client_results_discarded():
+    eng = EngineTest()
+    client = _ClientInfo('http://abc', 'abc', {}, None)
+    eng._apply_client_values = MagicMock()
+
+    # The client was removed while it was being polled
+    eng._apply_poll_results([ client ], [ ({ 'devices': [] }, None) ])
+    eng._apply_client_values.assert_not_called()
+
+
+def test_output_writes_batched_per_client():
+    eng = EngineTest()
+    session = MagicMock()
+    session.put.return_value.status_code = 200
+    session.put.return_value.json.return_value = {}
+    client = _ClientInfo('http://abc', 'abc', {}, None, session)
+    eng.clients = { 'abc': client }
+
+    out1 = MagicMock()
+    out1.name = 'abc.out1.o'
+    out2 = MagicMock()
+    out2.name = 'abc.out2.o'
+    eng.set_remote_device_value(out1, 1)
+    eng.set_remote_device_value(out2, 2)
+    eng.set_remote_device_value(out1, 3)
+    session.put.assert_not_called()
+
+    eng._write_outputs(eng._take_pending_writes())
+    eng._output_writer.flush()
+    session.put.assert_called_once()
+    args, kwargs = session.put.call_args
+    assert args[0] == 'http://abc/devices_set'
+    assert json.loads(kwargs['data']) == { 'devices': [ { 'name': 'out1.o', 'value': '3' },
+                                                        { 'name': 'out2.o', 'value': '2' } ] }
+    assert eng._take_pending_writes() == []
+
+
+def test_output_writes_fall_back_to_single_writes():
+    eng = EngineTest()
+    session = MagicMock()
+    session.put.return_value.status_code = 404
+    client = _ClientInfo('http://abc', 'abc', {}, None, session)
+
+    eng._write_client_outputs(client, { 'out1.o': 1, 'out2.o': 2 })
+    assert client.batch_writes == False
+    assert [ c[0][0] for c in session.put.call_args_list ] == [
+        'http://abc/devices_set', 'http://abc/device_set', 'http://abc/device_set' ]
+
+
+def test_push_client_values():
+    ''' Pushed values are applied and the modules using them run at once '''
+    eng = EngineTest()
+    eng.take_snapshot = MagicMock()
+    device = MagicMock()
+    device.name = 'abc.a.i'
+    device.error = None
+    client = _ClientInfo('http://abc', 'abc', { 'abc.a.i': device }, None)
+    client.compile_ingest_plan()
+    client.epoch = 'e'
+    eng.clients = { 'abc': client }
+    eng.devices = { 'abc.a.i': device }
+
+    @SwitchboardModule(['abc.a.i'], ['abc.b.o'])
+    def uses_a(inp, out): pass
+
+    @SwitchboardModule(['abc.c.i'], ['abc.d.o'])
+    def unrelated(inp, out): pass
+
+    eng.modules = { 'uses_a': MagicMock(module_class=uses_a.module_class),
+                    'unrelated': MagicMock(module_class=unrelated.module_class) }
+    for name, module in eng.modules.items():
+        eng._index_module(name, module.module_class)
+    eng._update_module_graph()
+    eng._triggered_modules.clear()
+
+    assert eng.push_client_values({ 'epoch': 'other', 'devices': [] }) is not None
+
+    # Badly formatted pushes are rejected rather than queued
+    for devices in [ 5, [ 'x' ], [ { 'value': 1 } ], [ { 'name': [ 'x' ], 'value': 1 } ] ]:
+        assert eng.push_client_values({ 'epoch': 'e', 'devices': devices }) is not None
+    assert len(eng._pushed_values) == 0
+
+    # The values are only queued by the pushing thread
+    values = { 'epoch': 'e', 'devices': [ { 'name': 'a.i', 'value': 5 } ] }
+    assert eng.push_client_values(values) is None
+    device.update_value.assert_not_called()
+
+    # The engine wakes up well before the next tick to apply them
+    eng._tick_timer.next_deadline = time.monotonic() + 10
+    with TimeElapsed() as t:
+        eng.switchboard_loop()
+    assert t.elapsed < 1
+    device.update_value.assert_called_once_with(5)
+    eng.modules['uses_a'].assert_called_once()
+    eng.modules['unrelated'].assert_not_called()
+    eng.take_snapshot.assert_called_once()
+
+
+def test_pushed_values_win_over_older_polls():
+    eng = EngineTest()
+    eng.take_snapshot = MagicMock()
+    device = RESTDevice({ 'name': 'abc.a.i', 'readable': True, 'writeable': False },
+                        'http://abc', None)
+    client = _ClientInfo('http://abc', 'abc', { 'abc.a.i': device }, None)
+    client.compile_ingest_plan()
+    client.epoch = 'e'
+    eng.clients = { 'abc': client }
+    eng.devices = { 'abc.a.i': device }
+
+    def push(value):
+        assert eng.push_client_values({ 'epoch': 'e', 'devices': [ { 'name': 'a.i', 'value': value } ] }) is None
+
+    # A value pushed while the client is being polled is newer than the
+    # value the poll returns
+    def fetch(client):
+        client.poll_started = time.monotonic()
+        push(2)
+        return { 'devices': [ { 'name': 'a.i', 'value': 1 } ], 'epoch': 'e' }, None
+    eng._fetch_client_values = fetch
+    eng.switchboard_loop()
+    assert device.value == 2
+
+    # A value pushed before the poll started is older
+    push(3)
+    time.sleep(0.001)
+    def fetch(client):
+        client.poll_started = time.monotonic()
+        return { 'devices': [ { 'name': 'a.i', 'value': 4 } ], 'epoch': 'e' }, None
+    eng._fetch_client_values = fetch
+    eng._tick_timer.next_deadline = None
+    eng.switchboard_loop()
+    assert device.value == 4
+    assert device.previous_value == 3
+
+
+def test_ingest_client_values():
+    ''' Polled values are applied through the client's ingest plan '''
+    eng = EngineTest()
+    devices = {}
+    for name in [ 'abc.a.i', 'abc.b.i' ]:
+        devices[name] = RESTDevice({ 'name': name, 'readable': True, 'writeable': False },
+                                   'http://abc', None)
+    client = _ClientInfo('http://abc', 'abc', devices, None)
+    client.compile_ingest_plan()
+    eng.clients = { 'abc': client }
+    eng.devices = dict(devices)
+
+    assert client.ingest_plan == { 'a.i': devices['abc.a.i'], 'b.i': devices['abc.b.i'] }
+
+    values = { 'devices': [ { 'name': 'a.i', 'value': 1 },
+                            { 'name': 'b.i', 'error': 'broken' },
+                            { 'name': 'unknown.i', 'value': 3 } ] }
+    eng._apply_client_values(client, values, None)
+    assert client.error is None
+    assert devices['abc.a.i'].value == 1
+    assert devices['abc.b.i'].error == 'broken'
+
+    # A badly formatted device puts the client in error
+    values = { 'devices': [ { 'name': 'a.i', 'value': 2 }, { 'name': 'b.i' } ] }
+    eng._apply_client_values(client, values, None)
+    assert 'b.i' in client.error
+    assert devices['abc.a.i'].error is not None
+
+    # So does a device that isn't a json object
+    eng._apply_client_values(client, { 'devices': [ { 'name': 'a.i', 'value': 3 } ] }, None)
+    assert client.error is None
+    eng._apply_client_values(client, { 'devices': [ 'x' ] }, None)
+    assert 'badly formatted' in client.error
+    assert devices['abc.a.i'].error is not None
+
+
+def test_changed_devices_are_snapshot():
+    ''' Only the devices that changed during a tick are passed to ws_ctrl '''
+    eng = EngineTest()
+    devices = {}
+    for name in [ 'abc.a.i', 'abc.b.i', 'abc.c.o' ]:
+        devices[name] = RESTDevice({ 'name': name, 'readable': True, 'writeable': True },
+                                   'http://abc', eng.set_remote_device_value)
+    client = _ClientInfo('http://abc', 'abc', devices, None)
+    client.compile_ingest_plan()
+    eng.clients = { 'abc': client }
+    eng.devices = dict(devices)
+
+    values = { 'devices': [ { 'name': 'a.i', 'value': 1 }, { 'name': 'b.i', 'value': None } ] }
+    eng._apply_client_values(client, values, None)
+    devices['abc.c.o'].output_signal.set_value(2)
+    assert eng._take_changed_devices() == set([ 'abc.a.i', 'abc.c.o' ])
+    assert eng._take_changed_devices() == set()
+
+    # The devices of a client going into error are recorded
+    eng._apply_client_values(client, None, 'Unable to access client')
+    assert eng._take_changed_devices() == set(devices.keys())
+
+
 def test_upsert_client():
     # TODO
     pass
@@ -134,10 +444,237 @@ def test_get_modules_using_client():
     @SwitchboardModule(['other_in'], ['other_out'])
     def uses_nothing(inp, out): pass
 
-    eng.clients = { 'client1': _Client(None, None, { 'in': None, 'out': None }, None) }
+    eng.clients = { 'client1': _ClientInfo(None, None, { 'in': None, 'out': None }, None) }
     eng.modules = { 'uses_out': uses_out,
                     'uses_in': uses_in,
                     'uses_nothing': uses_nothing }
+    for name, module in eng.modules.items():
+        eng._index_module(name, module.module_class)
 
     modules_using_client = eng.get_modules_using_client('client1')
     assert modules_using_client == set(['uses_in', 'uses_out'])
+
+
+def test_on_change_modules():
+    ''' Modules with the on_change trigger only run when one of their
+        inputs or its error state changes '''
+    eng = EngineTest()
+    device = RESTDevice({ 'name': 'abc.a.i', 'readable': True, 'writeable': False },
+                        'http://abc', None)
+    client = _ClientInfo('http://abc', 'abc', { 'abc.a.i': device }, None)
+    client.compile_ingest_plan()
+    eng.clients = { 'abc': client }
+    eng.devices = { 'abc.a.i': device }
+
+    calls = []
+
+    @SwitchboardModule(['abc.a.i'], { 'sig.s': None }, trigger='on_change')
+    def first(inp, out):
+        calls.append('first')
+        out.set_value(inp.get_value())
+
+    @SwitchboardModule(['sig.s'], {}, trigger='on_change')
+    def second(inp):
+        calls.append('second')
+
+    eng.modules = {}
+    for name, module in [ ('second', second), ('first', first) ]:
+        module.module_class.enabled = True
+        eng.modules[name] = module
+        eng._index_module(name, module.module_class)
+        module.module_class.create_argument_list(eng.devices)
+    eng.devices['sig.s'].on_change = eng._on_signal_changed
+    eng._update_module_graph()
+
+    # New modules run once
+    eng._evaluate_modules()
+    assert calls == [ 'first', 'second' ]
+
+    # Nothing changed
+    del calls[:]
+    eng._apply_client_values(client, { 'devices': [ { 'name': 'a.i', 'value': None } ] }, None)
+    eng._evaluate_modules()
+    assert calls == []
+
+    # The changed signal triggers the second module in the same tick
+    eng._apply_client_values(client, { 'devices': [ { 'name': 'a.i', 'value': 1 } ] }, None)
+    eng._evaluate_modules()
+    assert calls == [ 'first', 'second' ]
+
+    # Client errors trigger the modules using its devices
+    del calls[:]
+    eng._apply_client_values(client, None, 'Unable to access client')
+    assert eng._triggered_modules == set([ 'first' ])
+
+
+def test_parallel_module_groups():
+    ''' Independent groups of modules run concurrently '''
+    eng = EngineTest()
+    eng.configs['module_workers'] = '2'
+    calls = []
+
+    def slow_module(name):
+        def module():
+            time.sleep(0.1)
+            calls.append(name)
+        return module
+
+    eng.modules = {}
+    for name, inputs, outputs in [ ('a1', ['in1.i'], ['a.s']),
+                                   ('a2', ['a.s'], ['out1.o']),
+                                   ('b', ['in2.i'], ['out2.o']) ]:
+        eng.modules[name] = MagicMock(side_effect=slow_module(name),
+                                      module_class=MagicMock(inputs=inputs, outputs=outputs, trigger='always'))
+    eng._update_module_graph()
+
+    with TimeElapsed() as t:
+        eng._evaluate_modules()
+
+    assert t.elapsed < 0.25
+    assert sorted(calls) == [ 'a1', 'a2', 'b' ]
+    assert calls.index('a1') < calls.index('a2')
+
+
+def test_watchdog():
+    eng = EngineTest()
+
+    # No tick in progress
+    eng._check_watchdog(0.01)
+    assert eng.watchdog_alerts == 0
+
+    eng._tick_start_time = time.monotonic() - 1.0
+    eng._running_modules = { 1: ('slow_module', time.monotonic() - 0.5) }
+    eng._check_watchdog(2.0)
+    assert eng.watchdog_alerts == 0
+
+    # A hung tick is only reported once
+    eng._check_watchdog(0.1)
+    eng._check_watchdog(0.1)
+    assert eng.watchdog_alerts == 1
+
+
+def test_module_budget_defaults_from_config():
+    eng = EngineTest()
+    eng.configs['module_time_budget'] = '0.5'
+    eng.configs['module_max_overruns'] = '3'
+    eng._evaluate_modules()
+    eng.modules['mod1'].module_class.set_budget_defaults.assert_called_once_with(0.5, 3)
+
+
+def test_stats_broadcast():
+    eng = EngineTest()
+    eng.take_snapshot = MagicMock()
+
+    eng._finish_tick(set())
+    eng._finish_tick(set())
+    eng.send_stats.assert_called_once()
+    assert set(eng.send_stats.call_args[0][0]['modules']) == set([ 'mod1', 'mod2' ])
+
+
+def test_engine_stats():
+    eng = EngineTest()
+    eng.configs['poll_period'] = 0.0
+    eng.take_snapshot = MagicMock()
+    session = MagicMock()
+    session.get.side_effect = requests.exceptions.Timeout()
+    client = _ClientInfo('http://abc', 'abc', {}, None, session)
+    eng.clients = { 'abc': client }
+
+    eng.switchboard_loop()
+
+    stats = eng.get_engine_stats()
+    assert [ phase for phase, _ in stats['phases'] ] == [
+        'sleep', 'poll', 'apply', 'modules', 'outputs', 'snapshot' ]
+    assert all(s['count'] == 1 for _, s in stats['phases'])
+    assert stats['clients']['abc']['latency']['count'] == 1
+    assert stats['clients']['abc']['timeouts'] == 1
+    assert stats['clients']['abc']['errors'] == 0
+
+
+def test_failing_client_backs_off():
+    eng = EngineTest()
+    client = _ClientInfo('http://abc', 'abc', {}, None)
+    eng.clients = { 'abc': client }
+
+    for _ in range(3):
+        eng._apply_client_values(client, None, 'Unable to access client')
+    assert client.breaker.is_open()
+
+    # The client is skipped until its backoff expires
+    eng._tick_timer.next_deadline = None
+    assert eng._get_due_clients() == []
+
+    client.breaker.next_probe = time.monotonic()
+    eng._tick_timer.next_deadline = None
+    assert eng._get_due_clients() == [ client ]
+
+    eng._apply_client_values(client, { 'devices': [] }, None)
+    assert not client.breaker.is_open()
+
+
+def test_client_timeouts_follow_latency():
+    eng = EngineTest()
+    eng.configs['client_min_timeout'] = '0.1'
+    eng.configs['client_max_timeout'] = '4'
+    session = MagicMock()
+    session.get.return_value.json.return_value = { 'devices': [] }
+    client = _ClientInfo('http://abc', 'abc', {}, None, session)
+
+    eng._fetch_client_values(client)
+    assert session.get.call_args[1]['timeout'] == 4.0
+
+    # A fast client gets the min timeout
+    eng._fetch_client_values(client)
+    assert session.get.call_args[1]['timeout'] == 0.1
+
+
+def test_mixed_poll_periods():
+    ''' Polling a fast client in between ticks neither runs the modules
+        that aren't triggered nor reports changes of slow devices twice '''
+    eng = EngineTest()
+    eng.take_snapshot = MagicMock()
+    eng.configs['poll_period'] = 0.05
+
+    clients = {}
+    for alias, poll_period in [ ('slow', None), ('fast', 0.01) ]:
+        name = '{}.a.i'.format(alias)
+        device = RESTDevice({ 'name': name, 'readable': True, 'writeable': False },
+                            'http://' + alias, None)
+        clients[alias] = _ClientInfo('http://' + alias, alias, { name: device }, poll_period)
+        clients[alias].compile_ingest_plan()
+        eng.devices[name] = device
+    eng.clients = clients
+    eng._scheduler.add('fast', 0.01)
+
+    # The slow input changes once, at its second poll
+    slow_polls = []
+    def fetch(client):
+        if client.alias == 'slow':
+            slow_polls.append(client)
+            return { 'devices': [ { 'name': 'a.i', 'value': int(len(slow_polls) > 1) } ] }, None
+        return { 'devices': [ { 'name': 'a.i', 'value': 0 } ] }, None
+    eng._fetch_client_values = fetch
+
+    runs = []
+    edges = []
+
+    @SwitchboardModule(['slow.a.i', 'fast.a.i'])
+    def edge_module(slow_in, fast_in):
+        runs.append(len(slow_polls))
+        if slow_in.has_changed():
+            edges.append(slow_in.get_value())
+
+    edge_module.module_class.enabled = True
+    edge_module.module_class.create_argument_list(eng.devices)
+    eng.modules = { 'edge_module': edge_module }
+    eng._index_module('edge_module', edge_module.module_class)
+    eng._update_module_graph()
+
+    while len(slow_polls) < 4:
+        eng.switchboard_loop()
+
+    assert edges == [ 0, 1 ]
+
+    # The module runs at every tick and once more when the fast input
+    # first gets its value
+    assert len(runs) <= len(slow_polls) + 1
@@ -1,4 +1,7 @@
 
+import os
+import signal
+import time
 from copy import deepcopy
 
 import pytest
@@ -240,3 +243,153 @@ def test_call_swtchboard_standalone_module():
 
     assert set_value_callback.values['output1.o'] == 10 + 5 + 101
 
+
+
+def test_process_executor():
+    ''' The module runs in a worker process that keeps its static variables '''
+    from process_module import process_module
+
+    test_env = ModuleTestEnv()
+    module = process_module.module_class
+    module.enabled = True
+    module.create_argument_list(test_env.device_list)
+    test_env.device_list['input2.i'].update_value(21)
+
+    try:
+        process_module()
+        process_module()
+    finally:
+        module.shutdown()
+
+    assert set_value_callback.values['output1.o'] == 42
+    count, pid = set_value_callback.values['output2.io']
+    assert count == 2
+    assert pid != os.getpid()
+
+    # The static variables of the engine's copy of the module are untouched
+    assert process_module.count == 0
+
+
+def test_process_executor_startup_is_not_timed():
+    ''' Spawning the worker and importing the module don't count towards
+        the time budget of the module '''
+    from process_module import budget_process_module
+
+    test_env = ModuleTestEnv()
+    module = budget_process_module.module_class
+    module.enabled = True
+    module.create_argument_list(test_env.device_list)
+    test_env.device_list['input2.i'].update_value(21)
+
+    try:
+        budget_process_module()
+        budget_process_module()
+    finally:
+        module.shutdown()
+
+    assert module.overruns == 0
+    assert module.enabled
+    count, _ = set_value_callback.values['output2.io']
+    assert count == 2
+
+
+def test_process_executor_worker_dies():
+    ''' A dead worker loses one evaluation and is replaced by a new one '''
+    from process_module import process_module
+
+    test_env = ModuleTestEnv()
+    module = process_module.module_class
+    module.enabled = True
+    module.create_argument_list(test_env.device_list)
+    test_env.device_list['input2.i'].update_value(21)
+    set_value_callback.values = {}
+
+    try:
+        process_module()
+        _, pid = set_value_callback.values['output2.io']
+        os.kill(pid, signal.SIGKILL)
+
+        set_value_callback.values = {}
+        process_module()
+        assert set_value_callback.values == {}
+        assert module.get_stats()['crashes'] == 1
+
+        process_module()
+    finally:
+        module.shutdown()
+
+    count, new_pid = set_value_callback.values['output2.io']
+    assert new_pid != pid
+    assert count == 1
+
+
+def test_process_executor_class_method():
+    with pytest.raises(ModuleError):
+        class ClassModule:
+            @SwitchboardModule(inputs = [], outputs = {}, executor = 'process')
+            def module(self):
+                pass
+
+
+def test_time_budget():
+    @SwitchboardModule(inputs = [], outputs = {}, time_budget = 0.01, max_overruns = 2)
+    def SlowModule():
+        time.sleep(SlowModule.sleep_time)
+
+    module = SlowModule.module_class
+    module.enabled = True
+    module.create_argument_list({})
+
+    SlowModule.sleep_time = 0.02
+    SlowModule()
+    assert module.overruns == 1
+    assert module.enabled
+
+    # Only consecutive overruns count towards disabling the module
+    SlowModule.sleep_time = 0.0
+    SlowModule()
+    SlowModule.sleep_time = 0.02
+    SlowModule()
+    assert module.enabled
+    SlowModule()
+    assert module.overruns == 3
+    assert not module.enabled
+    assert 'time budget' in module.error
+
+    module.clear_time_budget_error()
+    assert module.error is None
+
+
+def test_default_time_budget():
+    @SwitchboardModule(inputs = [], outputs = {})
+    def SlowModule():
+        time.sleep(0.02)
+
+    module = SlowModule.module_class
+    module.enabled = True
+    module.create_argument_list({})
+
+    SlowModule()
+    assert module.overruns == 0
+
+    module.set_budget_defaults(0.01, 1)
+    SlowModule()
+    assert module.overruns == 1
+    assert not module.enabled
+
+
+def test_module_stats():
+    test_env = ModuleTestEnv()
+    test_env.module_class.create_argument_list(test_env.device_list)
+    before = test_env.module_class.get_stats()
+    test_env.device_list['input1.io'].update_value(2)
+    test_env.device_list['input2.i'].update_value(1)
+    test_env.DefaultModule()
+
+    test_env.device_list['input2.i'].error = 'Disconnected'
+    test_env.DefaultModule()
+
+    stats = test_env.module_class.get_stats()
+    assert stats['calls'] == before['calls'] + 1
+    assert stats['skipped'] == before['skipped'] + 1
+    assert stats['runtime']['max'] > 0
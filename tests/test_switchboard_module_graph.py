@@ -0,0 +1,70 @@
+from mock import MagicMock
+
+from switchboard.module_graph import ModuleGraph
+
+
+def module(inputs, outputs):
+    return MagicMock(inputs=inputs, outputs=outputs)
+
+
+def test_chain_is_ordered():
+    graph = ModuleGraph([
+        ('c', module(['b.s'], ['out.o'])),
+        ('b', module(['a.s'], ['b.s'])),
+        ('other', module(['in.i'], ['other.o'])),
+        ('a', module(['in.i'], ['a.s'])) ])
+
+    assert graph.order == [ 'other', 'a', 'b', 'c' ]
+    assert graph.cycles == []
+    assert graph.critical_path == [ 'a', 'b', 'c' ]
+    assert graph.critical_path_length() == 3
+
+
+def test_client_devices_do_not_create_dependencies():
+    ''' Values written to client devices are only read back at the next poll '''
+    graph = ModuleGraph([
+        ('reader', module(['dev.io'], ['out.o'])),
+        ('writer', module(['in.i'], ['dev.io'])) ])
+
+    assert graph.order == [ 'reader', 'writer' ]
+    assert graph.critical_path_length() == 1
+
+
+def test_cycles_are_reported():
+    graph = ModuleGraph([
+        ('downstream', module(['y.s'], ['out.o'])),
+        ('x', module(['y.s'], ['x.s'])),
+        ('y', module(['x.s'], ['y.s'])),
+        ('self', module(['self.s'], ['self.s'])),
+        ('independent', module(['in.i'], ['out2.o'])) ])
+
+    assert graph.cycles == [ [ 'x', 'y' ], [ 'self' ] ]
+
+    # Modules in a cycle keep the order they were added in and the
+    # modules that depend on them are evaluated after them
+    assert graph.order == [ 'independent', 'x', 'y', 'downstream', 'self' ]
+    assert graph.critical_path == [ 'independent' ]
+
+
+def test_cycles_are_ordered_between_their_neighbours():
+    graph = ModuleGraph([
+        ('last', module(['b.s', 'c.s'], ['out.o'])),
+        ('c', module(['b.s'], ['c.s'])),
+        ('b', module(['a.s'], ['b.s'])),
+        ('a', module(['b.s', 'first.s'], ['a.s'])),
+        ('first', module(['in.i'], ['first.s'])) ])
+
+    assert graph.cycles == [ [ 'b', 'a' ] ]
+    assert graph.order == [ 'first', 'b', 'a', 'c', 'last' ]
+    assert graph.critical_path == [ 'c', 'last' ]
+
+
+def test_components():
+    graph = ModuleGraph([
+        ('a', module(['in1.i'], ['a.s'])),
+        ('b', module(['a.s'], ['out1.o'])),
+        ('c', module(['in2.i'], ['out2.o'])),
+        ('d', module(['in3.i'], ['out1.o'])) ])
+
+    # Modules sharing any device, not just signals, belong together
+    assert graph.components == [ [ 'a', 'b', 'd' ], [ 'c' ] ]
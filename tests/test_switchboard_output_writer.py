@@ -0,0 +1,111 @@
+
+import time
+from threading import Event
+
+from mock import MagicMock
+
+from switchboard.output_writer import OutputWriter
+
+
+def make_client(alias):
+    client = MagicMock()
+    client.alias = alias
+    client.url = 'http://' + alias
+    return client
+
+
+def test_latest_value_wins():
+    written = []
+    unblock = Event()
+
+    def write(client, writes):
+        unblock.wait()
+        written.append(dict(writes))
+        return True
+
+    writer = OutputWriter(write)
+    client = make_client('c1')
+
+    # The first write blocks so the next submissions are coalesced
+    writer.submit([ (client, { 'out1.o': 1 }) ])
+    time.sleep(0.01)
+    writer.submit([ (client, { 'out1.o': 2, 'out2.o': 1 }) ])
+    writer.submit([ (client, { 'out1.o': 3 }) ])
+    assert writer.queue_depth() == 2
+
+    unblock.set()
+    assert writer.flush(timeout=1.0)
+    assert written == [ { 'out1.o': 1 }, { 'out1.o': 3, 'out2.o': 1 } ]
+    assert writer.superseded == 1
+    assert writer.get_stats()['write']['count'] == 2
+
+
+def test_failed_writes_replayed_on_resume():
+    results = [ False, True ]
+    written = []
+
+    def write(client, writes):
+        written.append(dict(writes))
+        return results.pop(0)
+
+    writer = OutputWriter(write)
+    client = make_client('c1')
+
+    writer.submit([ (client, { 'out1.o': 1, 'out2.o': 1 }) ])
+    assert writer.flush(timeout=1.0)
+    assert writer.failed == 1
+
+    # The client is unreachable so nothing is written until it is resumed
+    writer.submit([ (client, { 'out1.o': 2 }) ])
+    assert writer.flush(timeout=1.0)
+    assert len(written) == 1
+    assert writer.queue_depth() == 2
+
+    writer.resume(client)
+    assert writer.flush(timeout=1.0)
+    assert written[1] == { 'out1.o': 2, 'out2.o': 1 }
+    assert writer.queue_depth() == 0
+
+
+def test_remove_drops_pending_values():
+    writer = OutputWriter(lambda client, writes: False)
+    client = make_client('c1')
+
+    writer.submit([ (client, { 'out1.o': 1 }) ])
+    assert writer.flush(timeout=1.0)
+    writer.remove(client)
+    assert writer.queue_depth() == 0
+    assert writer.dropped == 1
+
+
+def test_remove_during_failed_write():
+    started = Event()
+    release = Event()
+    old_client = make_client('c1')
+    new_client = make_client('c1')
+    written = []
+
+    def write(client, writes):
+        if client is old_client:
+            started.set()
+            release.wait(1.0)
+            return False
+        written.append(writes)
+        return True
+
+    writer = OutputWriter(write)
+    writer.submit([ (old_client, { 'out1.o': 1 }) ])
+    assert started.wait(1.0)
+
+    # The client is removed while its write is in progress
+    writer.remove(old_client)
+    release.set()
+
+    assert writer.flush(timeout=1.0)
+    assert writer.queue_depth() == 0
+    assert writer.get_stats()['stalled_clients'] == 0
+
+    # A new client with the same alias isn't held back
+    writer.submit([ (new_client, { 'out1.o': 2 }) ])
+    assert writer.flush(timeout=1.0)
+    assert written == [ { 'out1.o': 2 } ]
@@ -0,0 +1,117 @@
+
+from switchboard.scheduler import PollScheduler, TickTimer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_clients_polled_at_their_own_period():
+    clock = FakeClock()
+    sched = PollScheduler(clock)
+    sched.add('door', 0.25)
+    sched.add('weather', 60.0)
+
+    assert sched.next_due() == 0.25
+    assert sched.pop_due() == []
+
+    polls = { 'door': 0, 'weather': 0 }
+    while clock.now < 60.0:
+        clock.now += 0.125
+        for alias in sched.pop_due():
+            polls[alias] += 1
+            sched.reschedule(alias)
+
+    assert polls['door'] == 240
+    assert polls['weather'] == 1
+
+
+def test_due_clients_not_returned_until_rescheduled():
+    clock = FakeClock()
+    sched = PollScheduler(clock)
+    sched.add('a', 1.0, due=0.0)
+
+    assert sched.pop_due() == [ 'a' ]
+    clock.now = 5.0
+    assert sched.pop_due() == []
+
+    # The poll overran its period so the next one is a period after completion
+    sched.reschedule('a', completed=5.0)
+    assert sched.next_due() == 6.0
+
+
+def test_reschedule_keeps_phase():
+    clock = FakeClock()
+    sched = PollScheduler(clock)
+    sched.add('a', 1.0, due=1.0)
+
+    clock.now = 1.2
+    assert sched.pop_due() == [ 'a' ]
+    sched.reschedule('a', completed=1.3)
+    assert sched.next_due() == 2.0
+
+
+def test_remove():
+    clock = FakeClock()
+    sched = PollScheduler(clock)
+    sched.add('a', 1.0)
+    sched.add('b', 2.0)
+    sched.remove('a')
+
+    assert not 'a' in sched
+    assert sched.next_due() == 2.0
+
+    clock.now = 2.0
+    assert sched.pop_due() == [ 'b' ]
+    sched.remove('b')
+    sched.reschedule('b')
+    assert sched.next_due() is None
+
+
+def test_tick_timer_keeps_phase():
+    clock = FakeClock()
+    timer = TickTimer(clock)
+    assert timer.is_due()
+    timer.tick(1.0)
+    assert timer.time_until_tick() == 1.0
+
+    # A tick that starts late doesn't shift the following ticks
+    clock.now = 1.25
+    assert timer.is_due()
+    timer.tick(1.0)
+    assert timer.next_deadline == 2.0
+    assert timer.overruns == 0
+    assert timer.get_stats()['jitter']['max'] == 0.25
+
+
+def test_tick_timer_skip_overrun():
+    clock = FakeClock()
+    timer = TickTimer(clock)
+    timer.tick(1.0, 'skip')
+
+    clock.now = 3.5
+    timer.tick(1.0, 'skip')
+    assert timer.next_deadline == 4.0
+    assert timer.overruns == 1
+    assert timer.skipped == 2
+
+
+def test_tick_timer_catch_up_overrun():
+    clock = FakeClock()
+    timer = TickTimer(clock)
+    timer.tick(1.0, 'catch_up')
+
+    clock.now = 3.5
+    ticks = 0
+    while timer.is_due():
+        timer.tick(1.0, 'catch_up')
+        ticks += 1
+
+    # The missed ticks at 1.0, 2.0 and 3.0 are run back to back
+    assert ticks == 3
+    assert timer.next_deadline == 4.0
+    assert timer.skipped == 0
@@ -0,0 +1,50 @@
+from switchboard.stats import HistogramStats, LatencyEstimator
+
+
+def test_histogram_percentiles():
+    stats = HistogramStats()
+    for i in range(1, 101):
+        stats.add(i / 1000.0)
+
+    summary = stats.summary()
+    assert summary['count'] == 100
+    assert abs(summary['total'] - 5.05) < 1e-9
+    assert summary['max'] == 0.1
+
+    # Percentiles are accurate to within a bucket
+    for p, expected in [ ('p50', 0.05), ('p95', 0.095), ('p99', 0.099) ]:
+        assert expected <= summary[p] <= expected * HistogramStats.GROWTH
+
+
+def test_histogram_extremes():
+    stats = HistogramStats()
+    assert stats.summary()['p99'] == 0.0
+
+    stats.add(0.0)
+    stats.add(0.0)
+    stats.add(1e6)
+    summary = stats.summary()
+    assert summary['p50'] == HistogramStats.MIN_DURATION
+    assert summary['p99'] == 1e6
+
+
+def test_latency_estimator():
+    estimator = LatencyEstimator()
+
+    # No estimate yet
+    assert estimator.timeout(0.2, 5.0) == 5.0
+
+    for _ in range(50):
+        estimator.add(0.01)
+    assert estimator.timeout(0.2, 5.0) == 0.2
+
+    for _ in range(50):
+        estimator.add(2.0)
+    assert 2.0 < estimator.timeout(0.2, 5.0) < 5.0
+
+    # Timeouts back off until the next response
+    timeout = estimator.timeout(0.0, 100.0)
+    estimator.on_timeout()
+    assert estimator.timeout(0.0, 100.0) == 2 * timeout
+    estimator.add(2.0)
+    assert estimator.timeout(0.0, 100.0) < 2 * timeout
@@ -0,0 +1,102 @@
+import pytest
+from mock import MagicMock
+
+pytest.importorskip('numpy')
+
+from switchboard.value_store import ValueStore, ColumnarRESTDevice, ColumnarSignalDevice
+
+
+def make_device(store, name):
+    return ColumnarRESTDevice(store, { 'name': name, 'readable': True, 'writeable': True },
+                              'http://url', MagicMock())
+
+
+def test_devices_are_views():
+    store = ValueStore(capacity=2)
+    devices = [ make_device(store, 'dev{}.io'.format(i)) for i in range(5) ]
+
+    devices[3].update_value(7)
+    devices[3].update_value([ 1, 2 ])
+    assert store.value[3] == [ 1, 2 ]
+    assert store.previous_value[3] == 7
+    assert devices[3].input_signal.has_changed()
+
+    devices[1].output_signal.set_value('on')
+    assert store.last_set_value[1] == 'on'
+
+    devices[0].error = 'broken'
+    assert devices[0].input_signal.get_error() == 'broken'
+    assert devices[4].value is None
+
+
+def test_take_changes():
+    store = ValueStore()
+    devices = [ make_device(store, 'dev{}.io'.format(i)) for i in range(3) ]
+    signal = ColumnarSignalDevice(store, 'sig.s')
+
+    # New devices are reported once
+    assert store.take_changes() == devices + [ signal ]
+    assert store.take_changes() == []
+
+    devices[2].update_value(1)
+    devices[0].output_signal.set_value(2)
+    signal.output_signal.set_value(3)
+    assert store.take_changes() == [ devices[0], devices[2], signal ]
+
+    # Unchanged values aren't reported
+    devices[2].update_value(1)
+    assert store.take_changes() == []
+
+
+def test_release():
+    store = ValueStore()
+    first = make_device(store, 'first.i')
+    first.update_value(5)
+    index = first._index
+    first.release()
+    assert store.take_changes() == []
+
+    # The id is reused without the old value
+    second = make_device(store, 'second.i')
+    assert second._index == index
+    assert second.value is None
+    assert store.take_changes() == [ second ]
+
+    # Modules still holding the released device keep its own values
+    second.update_value(7)
+    assert first.value == 5
+    first.update_value(6)
+    assert second.value == 7
+    assert store.take_changes() == [ second ]
+
+
+def test_rejected_device_does_not_take_a_row():
+    store = ValueStore()
+    with pytest.raises(Exception):
+        ColumnarRESTDevice(store, { 'name': 'dev.i', 'readable': False, 'writeable': False },
+                           'http://url', MagicMock())
+    assert store.take_changes() == []
+
+    device = make_device(store, 'dev.io')
+    assert device._index == 0
+    assert store.take_changes() == [ device ]
+
+
+def test_failed_upsert_releases_devices():
+    ''' An invalid device leaves the value store as it was '''
+    from test_switchboard_engine import EngineTest
+
+    store = ValueStore()
+    eng = EngineTest()
+    eng._value_store = store
+    session = MagicMock()
+    session.get.return_value.json.return_value = { 'devices': [
+            { 'name': 'good.i', 'readable': True, 'writeable': False },
+            { 'name': 'bad.i', 'readable': False, 'writeable': False } ] }
+
+    with pytest.raises(Exception):
+        eng._upsert_client_with_session('http://abc', 'abc', None, '', lambda s: None, session)
+
+    assert eng.devices == {}
+    assert store.take_changes() == []
+    assert store._free_ids == [ 0 ]
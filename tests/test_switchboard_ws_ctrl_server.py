@@ -0,0 +1,166 @@
+import json
+from threading import Thread
+
+import gevent
+from mock import MagicMock
+
+from switchboard.device import RESTDevice
+from switchboard.engine import _ClientInfo
+from switchboard.ws_ctrl_server import WSCtrlServer, _Subscriber
+
+
+def make_clients():
+    devices = {}
+    for name in [ 'abc.a.i', 'abc.b.i' ]:
+        devices[name] = RESTDevice({ 'name': name, 'readable': True, 'writeable': False },
+                                   'http://abc', None)
+    return { 'abc': _ClientInfo('http://abc', 'abc', devices, None) }, devices
+
+
+def sent_messages(ws):
+    return [ json.loads(call[0][0]) for call in ws.send.call_args_list ]
+
+
+def test_take_snapshot_with_changed_devices():
+    server = WSCtrlServer(MagicMock())
+    ws = MagicMock()
+    server._iodata_clients.add(ws)
+    clients, devices = make_clients()
+
+    server.take_snapshot(clients, devices)
+    assert sent_messages(ws)[-1]['command'] == 'update_table'
+
+    devices['abc.a.i'].update_value(1)
+    devices['abc.b.i'].update_value(2)
+
+    # Only the devices reported as changed are compared
+    server.take_snapshot(clients, devices, set([ 'abc.b.i' ]))
+    message = sent_messages(ws)[-1]
+    assert message['command'] == 'update_fields'
+    assert [ (f['device'], f['value']) for f in message['fields'] ] == [ ('abc.b.i', 2) ]
+
+    server.take_snapshot(clients, devices)
+    message = sent_messages(ws)[-1]
+    assert [ (f['device'], f['value']) for f in message['fields'] ] == [ ('abc.a.i', 1) ]
+
+    # Subscribers that fall behind are sent the up to date table
+    table = json.loads(server._get_table_data())['table']
+    assert [ d['value'] for d in table[0]['devices'] ] == [ 1, 2 ]
+
+
+def test_messages_are_serialized_once():
+    server = WSCtrlServer(MagicMock())
+    subscribers = [ MagicMock(), MagicMock() ]
+    server._iodata_clients.update(subscribers)
+
+    server.send_updates([ { 'device': 'abc.a.i', 'value': 1 } ])
+    first, second = [ s.send.call_args[0][0] for s in subscribers ]
+    assert first is second
+
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        gevent.sleep(0.01)
+    assert condition()
+
+
+def test_subscriber_sends_from_greenlet():
+    ws = MagicMock()
+    subscriber = _Subscriber(ws, 10)
+    greenlet = gevent.spawn(subscriber.run)
+
+    # Messages are queued from the engine thread
+    thread = Thread(target=lambda: [ subscriber.send(str(i)) for i in range(3) ])
+    thread.start()
+    thread.join()
+    ws.send.assert_not_called()
+
+    wait_for(lambda: ws.send.call_count == 3)
+    assert [ c[0][0] for c in ws.send.call_args_list ] == [ '0', '1', '2' ]
+
+    subscriber.close()
+    greenlet.join(1)
+    assert greenlet.dead
+
+
+def test_subscriber_overflow():
+    ws = MagicMock()
+    subscriber = _Subscriber(ws, 2)
+    greenlet = gevent.spawn(subscriber.run)
+
+    for i in range(3):
+        subscriber.send(str(i))
+
+    greenlet.join(1)
+    assert subscriber.overflowed
+    ws.send.assert_not_called()
+    ws.close.assert_called_once()
+
+
+def fields_message(*values):
+    fields = [ { 'device': device, 'value': value } for device, value in values ]
+    return json.dumps({ 'command': 'update_fields', 'fields': fields }), fields
+
+
+def test_subscriber_coalesces_updates():
+    ws = MagicMock()
+    subscriber = _Subscriber(ws, 10, 2, lambda: 'table')
+    greenlet = gevent.spawn(subscriber.run)
+
+    subscriber.send(*fields_message(('a', 1), ('b', 1)))
+    subscriber.send('table', is_table=True)
+    subscriber.send(*fields_message(('a', 2)))
+    subscriber.send(*fields_message(('b', 2), ('a', 3)))
+
+    wait_for(lambda: ws.send.call_count == 2)
+    table, fields = [ c[0][0] for c in ws.send.call_args_list ]
+    assert table == 'table'
+    assert json.loads(fields)['fields'] == [ { 'device': 'b', 'value': 2 }, { 'device': 'a', 'value': 3 } ]
+    assert subscriber.coalesced == 1
+
+    subscriber.close()
+    greenlet.join(1)
+
+
+def test_subscriber_resyncs_with_table():
+    ws = MagicMock()
+    get_table = MagicMock(return_value='table')
+    subscriber = _Subscriber(ws, 3, 2, get_table)
+    greenlet = gevent.spawn(subscriber.run)
+
+    for i in range(4):
+        subscriber.send(*fields_message(('a', i)))
+
+    wait_for(lambda: ws.send.call_count == 1)
+    ws.send.assert_called_once_with('table')
+    ws.close.assert_not_called()
+    assert subscriber.resyncs == 1
+
+    # The subscriber carries on with the following updates
+    subscriber.send(*fields_message(('a', 4)))
+    wait_for(lambda: ws.send.call_count == 2)
+
+    subscriber.close()
+    greenlet.join(1)
+
+
+def test_push_server_is_separate(monkeypatch):
+    ''' Only the push server may listen on a public interface '''
+    monkeypatch.setattr('switchboard.ws_ctrl_server.Thread', MagicMock())
+    config = MagicMock()
+    config.get.side_effect = { 'ws_port': 5000, 'push_port': 5001, 'push_host': '0.0.0.0' }.get
+    server = WSCtrlServer(config)
+    server.init_config()
+
+    assert [ r.rule for r in server._push_app.routes ] == [ '/devices_push' ]
+    assert not '/devices_push' in [ r.rule for r in server._app.routes ]
+
+    server._app.run = MagicMock()
+    server._push_app.run = MagicMock()
+    server.run()
+    server.run_push_server()
+    assert server._app.run.call_args[1]['host'] == 'localhost'
+    assert server._push_app.run.call_args[1]['host'] == '0.0.0.0'
+    assert server._push_app.run.call_args[1]['port'] == 5001